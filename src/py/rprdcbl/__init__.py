@@ -1,9 +1,33 @@
-from . import processing
+import os
+
+from . import configuration
 
 __all__ = [
-    "pass_initial_boundary", "pass_boundary", "pass_final_boundary"
+    "pass_initial_boundary", "pass_boundary", "pass_sampled_boundary",
+    "pass_final_boundary"
 ]
 
+# boundary calls may stay in scripts that are run without tracking
+__disabled = os.environ.get("RPRDCBL_DISABLE", "") not in {"", "0"}
+
+
+def __processing():
+    """Returns the processing module, which is imported on first use."""
+    from . import processing
+    return processing
+
+
+def __is_disabled():
+    """Indicates whether tracking is disabled in the current session."""
+    return __disabled or configuration._cget("disabled", False)
+
+
+def __disable_session():
+    """Uses a new session in which tracking is disabled."""
+    configuration._use_session(configuration._new_session())
+    configuration._cset("disabled", True)
+    return None
+
 
 def pass_initial_boundary(label=None,
                           quiet=True,
@@ -11,38 +35,266 @@ def pass_initial_boundary(label=None,
                           lock_file=None,
                           fail="never",
                           custom_collect=None,
-                          custom_test=None):
+                          custom_test=None,
+                          module_tracking="full",
+                          collect_mode="serial",
+                          collect_timeout=None,
+                          asynchronous=False,
+                          profile="none",
+                          prng="full",
+                          tolerances=None,
+                          journal=None,
+                          journal_sync="boundary",
+                          keep_data=True,
+                          resume=False,
+                          lock_format="indexed",
+                          global_tracking="names",
+                          global_size_limit=None,
+                          global_large="skip",
+                          hash_threads=0,
+                          report_to=None,
+                          sample_mode="every",
+                          sample_rate=1,
+                          sample_collectors=("PRNG", "PRNG_NumPy",
+                                             "custom"),
+                          custom_collect_key=None,
+                          reference_store=None,
+                          performance="none",
+                          performance_tolerance=None,
+                          track_files=None,
+                          file_cache=None,
+                          disable=False):
     """Configures the system and collects information for the initial boundary."""
-    processing._configure_testing(output_mode, lock_file, fail,
-                                  custom_collect, custom_test)
-    processing._process_boundary(label=label, quiet=quiet, final=False)
+    if disable or __is_disabled():
+        configuration._cset("disabled", True)
+        return None
+    processing = __processing()
+    processing._configure_testing(
+        output_mode=output_mode,
+        lock_file=lock_file,
+        failing=fail,
+        custom_collect=custom_collect,
+        custom_test=custom_test,
+        module_tracking=module_tracking,
+        collect_mode=collect_mode,
+        collect_timeout=collect_timeout,
+        asynchronous=asynchronous,
+        profile=profile,
+        prng=prng,
+        tolerances=tolerances,
+        journal=journal,
+        journal_sync=journal_sync,
+        keep_data=keep_data,
+        resume=resume,
+        lock_format=lock_format,
+        global_tracking=global_tracking,
+        global_size_limit=global_size_limit,
+        global_large=global_large,
+        hash_threads=hash_threads,
+        report_to=report_to,
+        sample_mode=sample_mode,
+        sample_rate=sample_rate,
+        sample_collectors=sample_collectors,
+        custom_collect_key=custom_collect_key,
+        reference_store=reference_store,
+        performance=performance,
+        performance_tolerance=performance_tolerance,
+        track_files=track_files,
+        file_cache=file_cache)
+    # a resumed run continues after the journaled boundaries
+    if not processing._is_resumed():
+        processing._process_boundary(label=label,
+                                     quiet=quiet,
+                                     final=False)
     return None
 
 
 def pass_boundary(label=None, quiet=True):
     """Marks an intermediary boundary."""
-    processing._process_boundary(label=label, quiet=quiet, final=False)
+    if __is_disabled():
+        return None
+    __processing()._process_boundary(label=label,
+                                     quiet=quiet,
+                                     final=False)
+    return None
+
+
+def pass_sampled_boundary(label=None, quiet=True):
+    """Marks an intermediary boundary that is only passed when sampled.
+
+    Calls are counted for each label and sampled according to the
+    sampling policy of the initial boundary (or of the reference), in
+    which case only the `sample_collectors` are collected.
+    """
+    if __is_disabled():
+        return None
+    __processing()._process_sampled_boundary(label=label, quiet=quiet)
     return None
 
 
 def pass_final_boundary(label=None, quiet=False):
     """Marks the final boundary and produces final output if request."""
-    processing._process_boundary(label=label, quiet=quiet, final=True)
+    if __is_disabled():
+        return None
+    __processing()._process_boundary(label=label,
+                                     quiet=quiet,
+                                     final=True)
     return None
 
 
-def get_state():
+def register_prng(generator, name):
+    """Adds a PRNG object to be tracked at each boundary.
+
+    Supported are NumPy `Generator`, `BitGenerator` and `RandomState`
+    objects and `random.Random` instances. PRNGs should be registered
+    before the initial boundary.
+    """
+    if __is_disabled():
+        return None
+    __processing()._register_generator(generator, name)
+    return None
+
+
+def get_state(boundaries=None,
+              collectors=None,
+              results_only=False,
+              view=False):
     """Returns a copy of the currently collected data.
 
     The returned data structure is a copy of the internal state and may change
-    in future versions.
+    in future versions. `boundaries` (boundary numbers starting at 1) and
+    `collectors` (names) restrict the boundaries and collected values
+    returned for the run and its reference, and `results_only` omits all
+    collected values. If `view` is true, a read-only view is returned
+    instead of a copy.
+    """
+    if __is_disabled():
+        return None
+    return __processing()._copy_state(boundaries=boundaries,
+                                      collectors=collectors,
+                                      results_only=results_only,
+                                      view=view)
+
+
+def get_profile():
+    """Returns a copy of the cost measurements of each boundary.
+
+    The list is empty unless profiling was enabled for the initial
+    boundary. The format may change in future versions.
+    """
+    if __is_disabled():
+        return list()
+    return __processing()._copy_profile()
+
+
+def get_worker_configuration():
+    """Returns the configuration for worker processes (see `start_worker`).
+
+    The configuration is picklable if `custom_collect` is.
+    """
+    if __is_disabled():
+        return None
+    return __processing()._worker_configuration()
+
+
+def start_worker(configuration, name, generators=None):
+    """Starts tracking in a worker process and passes its initial boundary.
+
+    `configuration` is the result of `get_worker_configuration()` in the
+    parent process and `name` identifies the worker's stream of
+    boundaries (e.g. the task number). `generators` is an optional dict
+    of names and PRNG objects to track (see `register_prng`). The calling
+    thread uses a new session (see `use_session`) and `pass_boundary()`
+    records the worker's boundaries. Workers only collect, the parent
+    tests their boundaries when they are merged.
+    """
+    if configuration is None or __is_disabled():
+        __disable_session()
+        return None
+    __processing()._start_worker(configuration, name, generators)
+    return None
+
+
+def finish_worker(label=None):
+    """Passes the final boundary of a worker and returns its stream.
+
+    The stream is picklable and is meant to be returned to the parent
+    process (e.g. as the result of the task or through a queue) and to
+    be passed to `merge_worker` there.
+    """
+    if __is_disabled():
+        return None
+    return __processing()._finish_worker(label=label)
+
+
+def merge_worker(stream):
+    """Adds the stream of a worker process to the current session.
+
+    The worker's boundaries are tested against the worker's stream of
+    the same name in the lock file. Streams must be merged before the
+    final boundary, which saves them to the lock file.
+    """
+    if __is_disabled():
+        return None
+    __processing()._merge_worker(stream)
+    return None
+
+
+def new_session():
+    """Returns a new, independent tracking session.
+
+    A session has its own configuration, boundaries, reference and lock
+    file. All other functions apply to the session of the calling thread
+    (see `use_session`), which is the default session unless changed.
+    """
+    return configuration._new_session()
+
+
+def use_session(session=None):
+    """Makes a session the current session of the calling thread.
+
+    `None` selects the default session. New threads start in the default
+    session. Returns a context manager that restores the previous session
+    on exit, so that `with use_session(new_session()): ...` tracks a
+    separate run. If the context exits with an exception, the session is
+    closed (see `close_session`).
     """
-    return processing._copy_state()
+    restore = configuration._use_session(session)
+
+    def _close_on_error(error_type, error, traceback):
+        if error_type is not None:
+            close_session(session)
+        return False
+
+    restore.push(_close_on_error)
+    return restore
+
+
+def close_session(session=None):
+    """Ends a session without passing its final boundary.
+
+    The resources of the session (e.g. collector threads, the journal
+    and the report file) are released and no lock file is written.
+    Further boundaries of the session raise an error, its state can
+    still be inspected. `None` closes the current session.
+    """
+    if session is None:
+        session = configuration._session()
+    if __disabled or session["configuration"].get("disabled", False) or \
+            len(session["configuration"]) == 0:
+        return None
+    __processing()._close_session(session)
+    return None
 
 
-def is_failing():
+def is_failing(wait=False):
     """Indicates whether reproducibility failure has been detected.
 
     This function may produce false negatives prior to the final boundary.
+    With asynchronous boundaries, `wait` waits for all pending tests.
     """
-    return processing._failure_detected(force=False)
+    if __is_disabled():
+        return False
+    if wait:
+        __processing()._wait_for_pending(wait=True)
+    return __processing()._failure_detected(force=False)
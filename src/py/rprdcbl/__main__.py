@@ -0,0 +1,149 @@
+"""Compares lock files of many runs.
+
+Usage: `python -m rprdcbl diff REFERENCE FILE...` compares each file to
+the reference and `python -m rprdcbl matrix FILE...` counts the
+differing boundaries of all pairs of files. Both also cluster the files
+into groups of equivalent runs and return 1 if there is more than one.
+"""
+import argparse
+import concurrent.futures
+import functools
+import json
+import sys
+
+from . import comparison
+from . import printers
+
+
+def _format_result(mode, reference, fname, boundary, result):
+    """Formats a test result of a boundary of a compared file."""
+    if mode == "parsable":
+        return "E: R=\"{}\" F=\"{}\" S=\"{}\" B={} L=\"{}\" C=\"{}\"".format(
+            printers._escape_dquote(reference),
+            printers._escape_dquote(fname),
+            printers._escape_dquote(boundary["stream"] or ""),
+            boundary["number"],
+            printers._escape_dquote(boundary["label"]),
+            printers._escape_dquote(printers._message(result)))
+    item = dict(type="result",
+                reference=reference,
+                file=fname,
+                stream=boundary["stream"],
+                boundary=boundary["number"],
+                label=boundary["label"],
+                message=printers._message(result))
+    if not isinstance(result, str):
+        item.update(result)
+    return json.dumps(item, default=str)
+
+
+def _format_count(mode, reference, fname, count):
+    """Formats the number of differing boundaries of a pair of files."""
+    if mode == "parsable":
+        return "M: R=\"{}\" F=\"{}\" N={}".format(
+            printers._escape_dquote(reference),
+            printers._escape_dquote(fname), count)
+    return json.dumps(
+        dict(type="count", reference=reference, file=fname,
+             count=count))
+
+
+def _format_group(mode, number, group):
+    """Formats a group of equivalent files."""
+    if mode == "parsable":
+        return "\n".join("G: N={} F=\"{}\"".format(
+            number, printers._escape_dquote(fname)) for fname in group)
+    return json.dumps(dict(type="group", group=number, files=group))
+
+
+def _diff(reference, fnames, mode, mapper, budget=None):
+    """Prints the differences of each file to the reference."""
+    compare = functools.partial(comparison._compare_pair, budget=budget)
+    for fname, differences in zip(
+            fnames,
+            mapper(compare, [(reference, fname) for fname in fnames])):
+        for boundary in differences:
+            for result in boundary["results"]:
+                print(
+                    _format_result(mode, reference, fname, boundary,
+                                   result))
+        sys.stdout.flush()
+    return None
+
+
+def _matrix(fnames, groups, mode, mapper):
+    """Prints the number of differing boundaries of all pairs of files.
+
+    Only the first files of the groups are compared, files of the same
+    group do not differ.
+    """
+    pairs = [(groups[i][0], groups[j][0])
+             for i in range(0, len(groups))
+             for j in range(i + 1, len(groups))]
+    counts = dict(zip(pairs, mapper(comparison._count_pair, pairs)))
+    first = {fname: group[0] for group in groups for fname in group}
+    for i, reference in enumerate(fnames):
+        for fname in fnames[i + 1:]:
+            pair = (first[reference], first[fname])
+            count = 0 if pair[0] == pair[1] else counts.get(
+                pair, counts.get(pair[::-1]))
+            print(_format_count(mode, reference, fname, count))
+    return None
+
+
+def main(arguments=None):
+    """Parses the command line arguments and compares the lock files."""
+    parser = argparse.ArgumentParser(prog="python -m rprdcbl")
+    parser.add_argument("--output-mode",
+                        choices=["parsable", "jsonl"],
+                        default="parsable")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        help="number of processes comparing files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    diff = commands.add_parser("diff",
+                               help="compare files to a reference")
+    diff.add_argument("--budget",
+                      type=int,
+                      default=None,
+                      help="largest number of differences per value")
+    diff.add_argument("reference")
+    diff.add_argument("files", nargs="+")
+    matrix = commands.add_parser(
+        "matrix", help="count the differences of all pairs of files")
+    matrix.add_argument("files", nargs="+")
+    arguments = parser.parse_args(arguments)
+    if arguments.jobs < 1:
+        parser.error("--jobs must be a positive number.")
+
+    executor = None
+    mapper = map
+    if arguments.jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=arguments.jobs)
+        mapper = functools.partial(executor.map, chunksize=4)
+    try:
+        if arguments.command == "diff":
+            _diff(arguments.reference,
+                  arguments.files,
+                  arguments.output_mode,
+                  mapper,
+                  budget=arguments.budget)
+            fnames = [arguments.reference] + arguments.files
+        else:
+            fnames = arguments.files
+        groups = comparison._groups(fnames, mapper=mapper)
+        if arguments.command == "matrix":
+            _matrix(fnames, groups, arguments.output_mode, mapper)
+        for number, group in enumerate(groups):
+            print(
+                _format_group(arguments.output_mode, number + 1, group))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return 0 if len(groups) < 2 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
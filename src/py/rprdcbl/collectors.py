@@ -1,8 +1,22 @@
 import sys
+import glob
+import json
+import mmap
 import platform
 import types
 import re
 import os
+import time
+import tracemalloc
+
+from . import util
+
+# only available on Unix-like systems; imported here so that it is not
+# reported as a module loaded between boundaries
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 def _collect_globals():
@@ -14,6 +28,71 @@ def _collect_globals():
     ])
 
 
+def __version_token(value):
+    """Returns a token that changes with a value (or None).
+
+    Tokens are only available for values that cannot change, i.e.
+    immutable builtin values and read-only NumPy arrays owning their
+    data. All other values have to be hashed at every boundary.
+    """
+    kind = type(value)
+    if kind in {type(None), bool, int, float, complex, str, bytes}:
+        return (kind, )
+    elif kind in {tuple, frozenset} and set(map(type, value)) <= {
+            type(None), bool, int, float, complex, str, bytes
+    }:
+        return (kind, len(value))
+    flags = getattr(value, "flags", None)
+    if hasattr(value, "dtype") and flags is not None and getattr(
+            flags, "owndata",
+            False) and not getattr(flags, "writeable", True):
+        return (kind, value.dtype.str, value.shape)
+    return None
+
+
+def _global_values_collector(size_limit=None,
+                             large="skip",
+                             executor=None):
+    """Returns a collector for fingerprints of 'global' variable values.
+
+    Modules and names starting with `__` are not included. Fingerprints
+    of unchanging values (see `__version_token`) are reused between
+    boundaries as long as the name refers to the same object. See
+    `util._value_fingerprint` for the remaining arguments.
+    """
+    cache = dict()
+
+    def _collect():
+        main = sys.modules['__main__']
+        fingerprints = dict()
+        current = dict()
+        for name in sorted(dir(main)):
+            value = getattr(main, name)
+            if name.startswith("__") or isinstance(
+                    value, types.ModuleType):
+                continue
+            token = __version_token(value)
+            cached = cache.get(name)
+            if token is not None and cached is not None and cached[
+                    0] is value and cached[1] == token:
+                fingerprint = cached[2]
+            else:
+                fingerprint = util._value_fingerprint(
+                    value,
+                    _size_limit=size_limit,
+                    _large=large,
+                    _executor=executor)
+            if token is not None:
+                current[name] = (value, token, fingerprint)
+            fingerprints[name] = fingerprint
+        # the cache only holds on to the current values
+        cache.clear()
+        cache.update(current)
+        return fingerprints
+
+    return _collect
+
+
 def _collect_version():
     """Collects version information."""
     fields = ["major", "minor", "micro", "releaselevel", "serial"]
@@ -48,6 +127,93 @@ def _collect_modules():
     }
 
 
+def _incremental_modules_collector():
+    """Returns a modules collector that only inspects changes.
+
+    A finder placed at the front of `sys.meta_path` records imports. If
+    no import was recorded and the size of `sys.modules` is unchanged,
+    the previous snapshot (the same object) is returned. Otherwise only
+    added, removed and (re-)imported modules are inspected and a new
+    snapshot is created. The second return value is an invalidation key
+    function (see `_modules_key`) and the third one removes the finder.
+    """
+    state = dict(imported=set(), imports=0, snapshot=None, size=-1)
+
+    def _find_spec(fullname, path=None, target=None):
+        state["imported"].add(fullname)
+        state["imports"] += 1
+        return None
+
+    finder = types.SimpleNamespace(find_spec=_find_spec)
+
+    def _collect():
+        modules = sys.modules
+        if state["snapshot"] is not None and len(
+                state["imported"]) == 0 and len(modules) == state["size"]:
+            return state["snapshot"]
+        imported = state["imported"]
+        state["imported"] = set()
+        previous = state["snapshot"] or dict()
+        names = set(modules.keys())
+        added = names - previous.keys()
+        removed = previous.keys() - names
+        updated = {
+            k: str(getattr(modules.get(k), "__version__", ""))
+            for k in (imported & names) | added
+        }
+        state["size"] = len(names)
+        if len(removed) == 0 and all(
+                previous.get(k) == v
+                for k, v in updated.items()) and (state["snapshot"]
+                                                  is not None):
+            return previous
+        snapshot = {
+            k: v
+            for k, v in previous.items() if k not in removed
+        }
+        snapshot.update(updated)
+        state["snapshot"] = snapshot
+        return snapshot
+
+    def _key():
+        return (len(sys.modules), state["imports"])
+
+    def _remove():
+        if finder in sys.meta_path:
+            sys.meta_path.remove(finder)
+        return None
+
+    sys.meta_path.insert(0, finder)
+    return _collect, _key, _remove
+
+
+def _modules_key():
+    """Returns an invalidation key function for the modules collectors.
+
+    The key changes with the size of `sys.modules` and with the number
+    of imports recorded by a finder placed at the front of
+    `sys.meta_path`. The second return value removes the finder.
+    """
+    state = dict(imports=0)
+
+    def _find_spec(fullname, path=None, target=None):
+        state["imports"] += 1
+        return None
+
+    finder = types.SimpleNamespace(find_spec=_find_spec)
+
+    def _key():
+        return (len(sys.modules), state["imports"])
+
+    def _remove():
+        if finder in sys.meta_path:
+            sys.meta_path.remove(finder)
+        return None
+
+    sys.meta_path.insert(0, finder)
+    return _key, _remove
+
+
 def _collect_lapack():
     """Returns scipy's loaded LAPACK version."""
     if "scipy.linalg.lapack" in sys.modules:
@@ -66,6 +232,191 @@ def _collect_prng():
         return list()
 
 
+def _collect_prng_digest():
+    """Returns a digest of the state of the `random` PRNG."""
+    if "random" in sys.modules:
+        import random
+        return util._digest(random.getstate())
+    else:
+        return list()
+
+
+def _generator_state(generator):
+    """Returns the state of a PRNG object.
+
+    Supported are NumPy's `Generator`, `BitGenerator` and `RandomState`
+    as well as `random.Random` instances.
+    """
+    if hasattr(generator, "bit_generator"):
+        return generator.bit_generator.state
+    elif hasattr(generator, "get_state"):
+        return generator.get_state()
+    elif hasattr(generator, "getstate"):
+        return generator.getstate()
+    else:
+        return generator.state
+
+
+def _prng_objects_collector(generators, digest=True):
+    """Returns a collector for NumPy's global and registered PRNGs.
+
+    `generators` is a (mutable) dict of names and PRNG objects. The
+    global (legacy) NumPy state is only included if `numpy.random` has
+    been loaded. States are stored as digests or, if `digest` is false,
+    in full (with arrays converted to lists).
+    """
+
+    def _collect():
+        states = dict()
+        if "numpy.random" in sys.modules:
+            states["legacy"] = sys.modules["numpy.random"].get_state()
+        if len(generators) > 0:
+            states["generators"] = {
+                name: _generator_state(generator)
+                for name, generator in generators.items()
+            }
+        if not digest:
+            return util._plain(states)
+        return {
+            k: ({
+                n: util._digest(s)
+                for n, s in v.items()
+            } if k == "generators" else util._digest(v))
+            for k, v in states.items()
+        }
+
+    return _collect
+
+
+def __peak_rss():
+    """Returns the peak resident set size of the process (or None)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes except on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def __traced_peak():
+    """Returns the peak of the traced memory since the previous call.
+
+    None is returned if `tracemalloc` is not tracing or if the peak
+    cannot be reset (before Python 3.9).
+    """
+    if not (tracemalloc.is_tracing()
+            and hasattr(tracemalloc, "reset_peak")):
+        return None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return peak
+
+
+def _performance_collector(memory=False):
+    """Returns a collector of the resources used since its previous call.
+
+    The wall and CPU time of the process (seconds) since the previous
+    call (or the creation of the collector) are collected, as well as
+    the peak resident set size of the process so far (bytes, None if not
+    available). If `memory` is true, the peak of the memory traced by
+    `tracemalloc` since the previous call is included (None if not
+    available).
+    """
+    state = dict(wall=time.perf_counter(), cpu=time.process_time())
+    if memory:
+        __traced_peak()
+
+    def _collect():
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        values = dict(wall=wall - state["wall"],
+                      cpu=cpu - state["cpu"],
+                      rss=__peak_rss())
+        if memory:
+            values["memory"] = __traced_peak()
+        state.update(wall=wall, cpu=cpu)
+        return values
+
+    return _collect
+
+
+def __file_digest(fname, executor=None):
+    """Returns the digest of the contents of a file (hexadecimal).
+
+    The file is memory-mapped and hashed in chunks (in parallel if an
+    `executor` is given), see `util._buffer_digest`.
+    """
+    with open(fname, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return util._buffer_digest(memoryview(b"")).hex()
+        with mmap.mmap(fh.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                return util._buffer_digest(view,
+                                           _executor=executor).hex()
+
+
+def _files_collector(patterns, cache_file=None, executor=None):
+    """Returns a collector for digests of the contents of files.
+
+    `patterns` are file names or (recursive) glob patterns. The collected
+    value is a dict of the matching file names and their digests, with
+    None for file names that do not exist. Digests are cached by inode,
+    size and modification time, within the run and, if a `cache_file` is
+    given, across runs. The second return value saves the cache file.
+    """
+    cache = dict()
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file, "r", encoding="utf-8") as fh:
+            stored = json.load(fh)
+        if stored.get("version") == 1:
+            cache.update({
+                fname: (tuple(entry[:3]), entry[3])
+                for fname, entry in stored["files"].items()
+            })
+    state = dict(value=None, changed=False)
+
+    def _collect():
+        value = dict()
+        for pattern in patterns:
+            fnames = sorted(glob.glob(pattern, recursive=True))
+            if len(fnames) == 0 and not any(c in pattern
+                                            for c in "*?["):
+                value[pattern] = None
+            for fname in fnames:
+                if fname in value or not os.path.isfile(fname):
+                    continue
+                stat = os.stat(fname)
+                key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                cached = cache.get(os.path.abspath(fname))
+                if cached is not None and cached[0] == key:
+                    value[fname] = cached[1]
+                    continue
+                value[fname] = __file_digest(fname, executor)
+                cache[os.path.abspath(fname)] = (key, value[fname])
+                state["changed"] = True
+        # unchanged files are represented by the same object
+        if value != state["value"]:
+            state["value"] = value
+        return state["value"]
+
+    def _save():
+        if cache_file is None or not state["changed"]:
+            return None
+        temporary = cache_file + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as fh:
+            json.dump(
+                dict(version=1,
+                     files={
+                         fname: list(key) + [digest]
+                         for fname, (key, digest) in cache.items()
+                     }), fh)
+        os.replace(temporary, cache_file)
+        state["changed"] = False
+        return None
+
+    return _collect, _save
+
+
 def _collect_locale():
     """Returns the state of locale as configured by the local environment (LANG, LANGUAGE, LC_*) """
     values = dict()
@@ -87,3 +438,30 @@ def _default_collectors():
                 LAPACK=_collect_lapack,
                 PRNG=_collect_prng,
                 global_names=_collect_globals)
+
+
+def _static_key():
+    """Returns the invalidation key of values that cannot change."""
+    return 0
+
+
+def _lapack_key():
+    """Returns the invalidation key of the LAPACK collector."""
+    return id(sys.modules.get("scipy.linalg.lapack"))
+
+
+def _default_collector_keys():
+    """Returns the invalidation key functions of the default collectors.
+
+    The value of a collector is only collected again if its key changed
+    since it was last collected. Collectors without a key function are
+    collected at every boundary. The modules key is added when testing
+    is configured (see `_modules_key` and
+    `_incremental_modules_collector`).
+    """
+    return dict(environment=_static_key,
+                variant=_static_key,
+                version=_static_key,
+                platform=_static_key,
+                os=_static_key,
+                LAPACK=_lapack_key)
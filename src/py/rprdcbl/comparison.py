@@ -0,0 +1,246 @@
+import hashlib
+import json
+
+from . import storage
+from . import testers
+
+
+def _open_lock_file(fname):
+    """Opens a lock file of either format for reading.
+
+    Only the index of the indexed format is read and values are decoded
+    when they are compared. The pickle format is loaded in full (with a
+    warning, see `storage._load_pickle`).
+    """
+    lock = storage._open_indexed(fname)
+    if lock is not None:
+        return lock
+    loaded_data = storage._load_pickle(fname)
+    return dict(boundaries=loaded_data["boundaries"],
+                workers=loaded_data.get("workers", dict()),
+                mapped=None)
+
+
+def _close_lock_file(lock):
+    """Closes a lock file opened with `_open_lock_file`."""
+    if lock["mapped"] is not None:
+        storage._close_indexed(lock)
+    return None
+
+
+def _streams(lock):
+    """Returns the names (None for the run itself) and boundary lists of
+    all streams of a lock file."""
+    streams = [(None, lock["boundaries"])]
+    streams.extend(sorted(lock["workers"].items()))
+    return streams
+
+
+def _boundary(lock, entry):
+    """Returns a boundary with its fingerprints (values are not decoded)."""
+    if lock["mapped"] is None:
+        return entry
+    return storage._index_boundary(lock, entry)
+
+
+def _value(lock, boundary, name):
+    """Decodes a collected value of a boundary (or returns None)."""
+    if lock["mapped"] is None:
+        return boundary.get("data", dict()).get(name)
+    elif name not in boundary["blobs"]:
+        return None
+    return storage._load_value(lock, boundary["blobs"][name])
+
+
+def _names(boundary):
+    """Returns the names of the collected values of a boundary."""
+    if "blobs" in boundary:
+        return set(boundary["blobs"].keys())
+    # lock files of earlier versions have no fingerprints
+    return set(boundary.get("data", dict()).keys()) | set(
+        boundary.get("fingerprints", dict()).keys())
+
+
+def _signature(fname):
+    """Returns a digest of the labels and fingerprints of a lock file.
+
+    Lock files with the same signature hold the same values (except for
+    the resources used, which are not part of the signature). None is
+    returned if a value has no fingerprint.
+    """
+    lock = _open_lock_file(fname)
+    try:
+        digest = hashlib.sha1()
+        for name, stream in _streams(lock):
+            for entry in stream:
+                boundary = _boundary(lock, entry)
+                fingerprints = boundary.get("fingerprints", dict())
+                names = _names(boundary) - {"performance"}
+                if any(
+                        fingerprints.get(value_name) is None
+                        for value_name in names):
+                    return None
+                digest.update(
+                    json.dumps([
+                        name, boundary["label"],
+                        sorted((value_name, fingerprints[value_name])
+                               for value_name in names)
+                    ]).encode("utf-8"))
+        return digest.hexdigest()
+    finally:
+        _close_lock_file(lock)
+
+
+def _fingerprint_of(boundary, name):
+    """Returns the fingerprint of a collected value (or None)."""
+    return boundary.get("fingerprints", dict()).get(name)
+
+
+def _compare_boundaries(reference_lock,
+                        reference,
+                        latest_lock,
+                        latest,
+                        budget,
+                        performance=True):
+    """Returns the test results of a boundary against a reference.
+
+    The resources used are compared with the default tolerances if
+    `performance` is true, and not at all otherwise.
+    """
+    results = list()
+    if latest["label"] != reference["label"]:
+        results.append(
+            ("The label for boundary #{} does not match the " +
+             "reference value ('{}' != '{}').").format(
+                 latest["number"], latest["label"], reference["label"]))
+    for name in sorted(_names(latest) | _names(reference)):
+        if name == "performance":
+            if performance:
+                results.extend(
+                    testers._performance_test(
+                        _value(latest_lock, latest, name),
+                        None,
+                        _value(reference_lock, reference, name),
+                        _name=name,
+                        _latest_type="default",
+                        _budget=budget,
+                        _tolerance=testers._performance_tolerance))
+            continue
+        fingerprints = (_fingerprint_of(latest, name), None,
+                        _fingerprint_of(reference, name))
+        if fingerprints[0] is not None and fingerprints[
+                0] == fingerprints[2]:
+            # not decoded, the fingerprints already match
+            continue
+        results.extend(
+            testers._deep_lr_equality_test(_value(latest_lock, latest,
+                                                  name),
+                                           None,
+                                           _value(reference_lock,
+                                                  reference, name),
+                                           _name=name,
+                                           _latest_type="default",
+                                           _fingerprints=fingerprints,
+                                           _budget=budget))
+    return results
+
+
+__missing = "The {}boundary #{} does not have a corresponding boundary{}."
+
+
+def _compare(reference_fname, fname, budget=None, performance=True):
+    """Compares a lock file to a reference lock file.
+
+    Both files are read one boundary (and value) at a time, see
+    `_compare_boundaries`. Returns the boundaries with test results as
+    dicts with the stream name (None for the run itself), number, label
+    and results.
+    """
+    reference_lock = _open_lock_file(reference_fname)
+    latest_lock = _open_lock_file(fname)
+    try:
+        reference_streams = dict(_streams(reference_lock))
+        differences = list()
+        for name, stream in _streams(latest_lock):
+            reference_stream = reference_streams.pop(name, list())
+            for b in range(0, max(len(stream), len(reference_stream))):
+                if b >= len(reference_stream):
+                    results = [
+                        __missing.format("", b + 1, " in the reference")
+                    ]
+                elif b >= len(stream):
+                    results = [
+                        __missing.format("reference ", b + 1, "")
+                    ]
+                else:
+                    results = _compare_boundaries(
+                        reference_lock,
+                        _boundary(reference_lock,
+                                  reference_stream[b]), latest_lock,
+                        _boundary(latest_lock, stream[b]), budget,
+                        performance)
+                if len(results) > 0:
+                    source = stream if b < len(stream) else \
+                        reference_stream
+                    differences.append(
+                        dict(stream=name,
+                             number=b + 1,
+                             label=source[b]["label"],
+                             results=results))
+        for name in sorted(reference_streams.keys()):
+            differences.append(
+                dict(stream=name,
+                     number=None,
+                     label=None,
+                     results=[
+                         "The worker `{}` is missing.".format(name)
+                     ]))
+        return differences
+    finally:
+        _close_lock_file(reference_lock)
+        _close_lock_file(latest_lock)
+
+
+def _compare_pair(pair, budget=None):
+    """Calls `_compare` with a pair of file names (for `map`)."""
+    return _compare(pair[0], pair[1], budget=budget)
+
+
+def _count_pair(pair):
+    """Returns the number of differing boundaries of a pair of files.
+
+    As for signatures, the resources used are not compared.
+    """
+    return len(_compare(pair[0], pair[1], budget=1, performance=False))
+
+
+def _groups(fnames, mapper=map):
+    """Clusters lock files into groups of equivalent runs.
+
+    Files with the same signature are grouped without decoding any
+    values. The first file of each remaining group is compared to the
+    first files of the groups found so far, in rounds that are passed to
+    `mapper` (e.g. the `map` function of a process pool). Returns the
+    groups as lists of file names in the order of `fnames`.
+    """
+    by_signature = dict()
+    candidates = list()
+    for fname, signature in zip(fnames, mapper(_signature, fnames)):
+        if signature is not None and signature in by_signature:
+            by_signature[signature].append(fname)
+            continue
+        group = [fname]
+        if signature is not None:
+            by_signature[signature] = group
+        candidates.append(group)
+    groups = list()
+    for group in candidates:
+        counts = list(
+            mapper(_count_pair,
+                   [(other[0], group[0]) for other in groups]))
+        if 0 in counts:
+            groups[counts.index(0)].extend(group)
+        else:
+            groups.append(group)
+    order = {fname: i for i, fname in enumerate(fnames)}
+    return [sorted(group, key=order.get) for group in groups]
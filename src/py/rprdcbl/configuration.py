@@ -1,14 +1,53 @@
+# `_thread` is used instead of `threading` to keep the import cheap
+import _thread
+
 _configuration = dict()
+_default_session = dict(configuration=_configuration,
+                        data=dict(),
+                        lock=_thread.RLock())
+__current = _thread._local()
+
+
+def _new_session():
+    """Returns a new session with its own configuration and data."""
+    return dict(configuration=dict(), data=dict(), lock=_thread.RLock())
+
+
+def _session():
+    """Returns the session of the calling thread (or the default session)."""
+    session = getattr(__current, "session", None)
+    return _default_session if session is None else session
+
+
+def _use_session(session=None):
+    """Sets the session of the calling thread.
+
+    Returns a context manager restoring the previous session on exit.
+    """
+    import contextlib
+    if session is not None and not (isinstance(session, dict)
+                                    and "configuration" in session):
+        raise Exception("`{}` is not a valid session.".format(
+            str(session)))
+    previous = getattr(__current, "session", None)
+    __current.session = session
+    restore = contextlib.ExitStack()
+    restore.callback(setattr, __current, "session", previous)
+    return restore
+
+
+def _in_session(session, fun, *args, **kwargs):
+    """Calls a function within a session (e.g. in another thread)."""
+    with _use_session(session):
+        return fun(*args, **kwargs)
 
 
 def _cget(key, default=None):
     """Returns a configuration key or the default value."""
-    global _configuration
-    return _configuration.get(key, default)
+    return _session()["configuration"].get(key, default)
 
 
 def _cset(key, value=None):
     """Sets a configuration key."""
-    global _configuration
-    _configuration.update({key: value})
+    _session()["configuration"].update({key: value})
     return value
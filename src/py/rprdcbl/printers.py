@@ -1,8 +1,63 @@
+import json
+import logging
+import sys
+
+
 def _escape_dquote(s):
     """Escapes double-quotes."""
     return str(s).replace("\"", "\\\"") if s is not None else None
 
 
+def _message(result):
+    """Converts a test result (a message or difference record) to a message."""
+    if result is None or isinstance(result, str):
+        return result
+    kind = result.get("kind")
+    path, x, y = result["path"], result["x"], result["y"]
+    if kind == "none":
+        return "The {} value for '{}' is None but the {} value is not.".format(
+            *((x, path, y) if result["observed"] is None else (y, path,
+                                                               x)))
+    elif kind == "class":
+        return "Mismatching classes for {} and {} of '{}'.".format(
+            x, y, path)
+    elif kind == "extra":
+        if result["observed"] is not None:
+            first, second, keys = x, y, result["observed"]
+        else:
+            first, second, keys = y, x, result["expected"]
+        return ("Elements in '{}' only contained in the {} dictionary " +
+                "(but not in the {}): {}").format(path, first, second,
+                                                  ", ".join(keys))
+    elif kind == "length":
+        return "The lengths of '{}' differ ({} {}, {} {}).".format(
+            path, x, result["observed"], y, result["expected"])
+    elif kind == "shape":
+        return "The shapes of '{}' differ ({} {}, {} {}).".format(
+            path, x, tuple(result["observed"]), y,
+            tuple(result["expected"]))
+    elif kind == "dtype":
+        return "The data types of '{}' differ ({} {}, {} {}).".format(
+            path, x, result["observed"], y, result["expected"])
+    elif kind == "array":
+        return ("The values of '{}' differ in {} of {} elements " +
+                "(maximum absolute error {}, first at {}).").format(
+                    path, result["observed"], result["expected"],
+                    result.get("max_error"), ", ".join(
+                        str(tuple(i))
+                        for i in result.get("indices", [])))
+    elif kind == "performance":
+        return ("The {} value of '{}' exceeds the {} value by more " +
+                "than the tolerance ({} {}, {} {}).").format(
+                    x, path, y, x, result["observed"], y,
+                    result["expected"])
+    elif kind == "truncated":
+        return "Further differences in '{}' are not reported.".format(
+            path)
+    else:
+        return "The values of '{}' differ.".format(path)
+
+
 def _formatter_pretty(boundary):
     """Converts boundary error information to human-readable message strings."""
     if boundary is None:
@@ -11,7 +66,7 @@ def _formatter_pretty(boundary):
         return None
     return "Boundary \"{}\" (#{}): {}".format(
         boundary["label"], boundary["number"],
-        "  \n".join(boundary["results"]))
+        "  \n".join(_message(result) for result in boundary["results"]))
 
 
 def _formatter_parsable(boundary):
@@ -21,30 +76,207 @@ def _formatter_parsable(boundary):
     if boundary["results"] is None or len(boundary["results"]) == 0:
         return None
     return [
-        "E: B={} L=\"{}\" C=\"{}\"".format(boundary["number"],
-                                           boundary["label"],
-                                           _escape_dquote(result))
+        "E: B={} L=\"{}\" C=\"{}\"".format(
+            boundary["number"], boundary["label"],
+            _escape_dquote(_message(result)))
         for result in boundary["results"] if result is not None
     ]
 
 
-def _print_report(b=None, boundaries=None, mode="pretty"):
-    """Prints boundary error information to stdout.
+def _formatter_jsonl(boundary):
+    """Converts boundary error information to JSON lines.
+
+    Each line is an object with the boundary number and label, the
+    message, and the fields of difference records.
+    """
+    if boundary is None:
+        return None
+    if boundary["results"] is None or len(boundary["results"]) == 0:
+        return None
+    lines = list()
+    for result in boundary["results"]:
+        if result is None:
+            continue
+        item = dict(type="result",
+                    boundary=boundary["number"],
+                    label=boundary["label"],
+                    message=_message(result))
+        if not isinstance(result, str):
+            item.update(result)
+        lines.append(json.dumps(item, default=str))
+    return lines
+
+
+def __write_stdout(line, level=logging.WARNING):
+    """Writes a line to (the current) stdout."""
+    sys.stdout.write(line + "\n")
+    return None
+
+
+def __flush_stdout():
+    """Flushes (the current) stdout."""
+    sys.stdout.flush()
+    return None
+
+
+def __noop():
+    return None
+
+
+def _create_reporter(target=None):
+    """Returns a reporter writing lines to a target.
+
+    The target is stdout (None), a file name (lines are appended), a
+    `logging.Logger` (results are logged as warnings, profiles as
+    information), or a function called with each line and its logging
+    level. A reporter is a dict of the functions `write(line, level)`,
+    `flush()` and `close()`.
+    """
+    if target is None:
+        return dict(write=__write_stdout,
+                    flush=__flush_stdout,
+                    close=__noop)
+    elif isinstance(target, str):
+        fh = open(target, "a", buffering=1 << 16)
+
+        def _write(line, level=logging.WARNING):
+            fh.write(line + "\n")
+            return None
+
+        return dict(write=_write, flush=fh.flush, close=fh.close)
+    elif isinstance(target, logging.Logger):
+
+        def _log(line, level=logging.WARNING):
+            target.log(level, line)
+            return None
+
+        return dict(write=_log, flush=__noop, close=__noop)
+    elif callable(target):
+        return dict(write=target, flush=__noop, close=__noop)
+    raise Exception("`{}` is not a valid report target.".format(
+        str(target)))
+
 
-    Caputres all `b` boundaries from `boundaries` or the global default
-    to message strings using the given mode ('pretty', or 'parsable' otherwise)
-    and prints it to stdout using `print`.
+def __formatter(mode):
+    """Returns the boundary formatter of an output mode."""
+    if mode == "pretty":
+        return _formatter_pretty
+    elif mode == "jsonl":
+        return _formatter_jsonl
+    return _formatter_parsable
+
+
+def _print_report(b=None,
+                  boundaries=None,
+                  mode="pretty",
+                  reporter=None):
+    """Writes boundary error information to a reporter (or stdout).
+
+    Formats all `b` boundaries from `boundaries` using the given mode
+    ('pretty', 'jsonl', or 'parsable' otherwise) and writes them one
+    boundary at a time, flushing the reporter at the end.
     """
     if boundaries is None:
-        return list()
+        return None
     if b is None:
-        b = len(boundaries)
+        b = range(1, len(boundaries) + 1)
+    if reporter is None:
+        reporter = _create_reporter()
+    formatter = __formatter(mode)
+    for n in b:
+        item = formatter(boundaries[n - 1])
+        if item is None:
+            continue
+        for line in ([item] if isinstance(item, str) else item):
+            reporter["write"](line, logging.WARNING)
+    reporter["flush"]()
+    return None
+
+
+def _format_measurement(measurement):
+    """Converts a single measurement to a human-readable string."""
+    text = "wall {:.3f} ms, cpu {:.3f} ms".format(
+        measurement["wall"] * 1e3, measurement["cpu"] * 1e3)
+    if measurement["memory"] is not None:
+        text += ", memory {} bytes".format(measurement["memory"])
+    return text
+
+
+def _profile_pretty(profile):
+    """Converts boundary measurements to human-readable summary strings.
+
+    Measurements are summed up over all boundaries for each stage,
+    collector and tester.
+    """
+    totals = dict()
+    for boundary in profile:
+        for group in ["stages", "collectors", "testers"]:
+            for name, measurement in boundary[group].items():
+                total = totals.setdefault((group, name),
+                                          dict(wall=0.0,
+                                               cpu=0.0,
+                                               memory=None))
+                total["wall"] += measurement["wall"]
+                total["cpu"] += measurement["cpu"]
+                if measurement["memory"] is not None:
+                    total["memory"] = (total["memory"]
+                                       or 0) + measurement["memory"]
+    return [
+        "Profile of {} {} over {} boundaries: {}".format(
+            group[:-1], name, len(profile), _format_measurement(total))
+        for (group, name), total in totals.items()
+    ]
+
+
+def _profile_parsable(profile):
+    """Converts boundary measurements to parsable strings."""
+    return [
+        "P: B={} L=\"{}\" K=\"{}\" N=\"{}\" W={:.9f} C={:.9f} M={}".
+        format(
+            boundary["number"], _escape_dquote(boundary["label"]),
+            group[:-1], _escape_dquote(name), measurement["wall"],
+            measurement["cpu"], "NA"
+            if measurement["memory"] is None else measurement["memory"])
+        for boundary in profile
+        for group in ["stages", "collectors", "testers"]
+        for name, measurement in boundary[group].items()
+    ]
+
+
+def _profile_jsonl(profile):
+    """Converts boundary measurements to JSON lines."""
+    return [
+        json.dumps(
+            dict(type="profile",
+                 boundary=boundary["number"],
+                 label=boundary["label"],
+                 kind=group[:-1],
+                 name=name,
+                 wall=measurement["wall"],
+                 cpu=measurement["cpu"],
+                 memory=measurement["memory"])) for boundary in profile
+        for group in ["stages", "collectors", "testers"]
+        for name, measurement in boundary[group].items()
+    ]
+
+
+def _print_profile(profile=None, mode="pretty", reporter=None):
+    """Writes boundary measurements to a reporter (or stdout).
+
+    The pretty mode writes totals per stage, collector and tester, the
+    other modes write one line per boundary and measurement.
+    """
+    if profile is None:
+        return None
+    if reporter is None:
+        reporter = _create_reporter()
     if mode == "pretty":
-        formatter = _formatter_pretty
+        items = _profile_pretty(profile)
+    elif mode == "jsonl":
+        items = _profile_jsonl(profile)
     else:
-        formatter = _formatter_parsable
-    # do not combine the following lines (for easier debugging)
-    items = [formatter(boundaries[n - 1]) for n in b]
-    items = [item for item in items if item is not None]
+        items = _profile_parsable(profile)
     for item in items:
-        print(item)
+        reporter["write"](item, logging.INFO)
+    reporter["flush"]()
+    return None
@@ -2,39 +2,176 @@ from . import configuration
 from . import collectors
 from . import testers
 from . import printers
+from . import storage
+from . import util
+import concurrent.futures
+import functools
 import os.path
 import pickle
+import queue
+import sys
 import copy
+import math
+import multiprocessing
+import threading
+import time
+import tracemalloc
+import types
 
-_data = dict()
+# the data of the default session, see `configuration._session`
+_data = configuration._default_session["data"]
 
 
 def _reset_data():
-    global _data
+    _data = configuration._session()["data"]
     _data.clear()
     _data.update(failing=False,
+                 failures=list(),
                  boundaries=list(),
                  reference=None,
-                 finalized=False)
+                 finalized=False,
+                 finalizers=list(),
+                 pending=list(),
+                 profile=list(),
+                 store=dict(),
+                 views=dict(),
+                 journal=None,
+                 lock_file=None,
+                 decoded=dict(),
+                 running=dict(),
+                 cached=dict(),
+                 workers=dict(),
+                 reference_workers=dict(),
+                 reference_sampling=None,
+                 samples=dict(),
+                 sampled=None,
+                 cache=dict(),
+                 store_key=None,
+                 store_match=False,
+                 reference_ignored=set(),
+                 lock=threading.RLock())
+    return None
+
+
+def _run_finalizers():
+    # all finalizers are run, the first error is raised afterwards
+    _data = configuration._session()["data"]
+    finalizers = _data.get("finalizers", list())
+    error = None
+    while len(finalizers) > 0:
+        try:
+            finalizers.pop()()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
     return None
 
 
 def _failure_detected(force=False):
-    global _data
-    indicator = _data["failing"]
-    return indicator is not None and (indicator if isinstance(
-        indicator, bool) else any(indicator))
+    _data = configuration._session()["data"]
+    return bool(_data["failing"])
+
+
+def _project(boundary, collectors=None, results_only=False):
+    if boundary is None:
+        return None
+    if results_only:
+        keys = ["label", "number", "final", "results"]
+    else:
+        keys = list(boundary.keys())
+    projection = {k: boundary[k] for k in keys if k in boundary}
+    if collectors is not None:
+        for k in ["data", "fingerprints"]:
+            if k in projection:
+                projection[k] = {
+                    name: value
+                    for name, value in projection[k].items()
+                    if name in collectors
+                }
+    return projection
+
+
+def _view(boundary):
+    _data = configuration._session()["data"]
+    if boundary is None:
+        return None
+    view = dict()
+    for k, value in boundary.items():
+        if k == "data":
+            # the collected values are shared and their views are cached
+            value = types.MappingProxyType({
+                name:
+                util._freeze(v, _data["views"])
+                for name, v in value.items()
+            })
+        else:
+            value = util._freeze(value)
+        view[k] = value
+    return types.MappingProxyType(view)
+
 
+def _copy_state(boundaries=None,
+                collectors=None,
+                results_only=False,
+                view=False):
+    _data = configuration._session()["data"]
+    with _data["lock"]:
+        selected = list()
+        for source in [_data["boundaries"], _data["reference"]]:
+            if source is None:
+                selected.append(None)
+                continue
+            numbers = range(1, len(source) + 1) if boundaries is None \
+                else boundaries
+            selected.append([
+                _project(
+                    _reference_boundary(_boundary_at(source, n - 1),
+                                        collectors, results_only),
+                    collectors, results_only) for n in numbers
+                if 1 <= n <= len(source)
+            ])
+        if view:
+            return types.MappingProxyType(
+                dict(boundaries=tuple(_view(b) for b in selected[0]),
+                     reference=None if selected[1] is None else tuple(
+                         _view(b) for b in selected[1]),
+                     failures=tuple(_data["failures"]),
+                     failing=_failure_detected(force=False),
+                     workers=types.MappingProxyType({
+                         name:
+                         tuple(_view(b) for b in stream)
+                         for name, stream in _data["workers"].items()
+                     })))
+        return dict(boundaries=copy.deepcopy(selected[0]),
+                    reference=copy.deepcopy(selected[1]),
+                    failures=list(_data["failures"]),
+                    failing=_failure_detected(force=False),
+                    workers=copy.deepcopy(_data["workers"]))
 
-def _copy_state():
-    global _data
-    return dict(boundaries=copy.deepcopy(_data["boundaries"]),
-                reference=copy.deepcopy(_data["reference"]),
-                failing=_failure_detected(force=False))
 
+def _copy_profile():
+    _data = configuration._session()["data"]
+    with _data["lock"]:
+        return copy.deepcopy(_data["profile"])
 
-def _collect(label=None, final=False):
-    global _data
+
+def _profile_of(b):
+    _data = configuration._session()["data"]
+    if configuration._cget("profile", "none") == "none":
+        return None
+    return _data["profile"][b]
+
+
+def _timed(profile, group, name, fun, *args, **kwargs):
+    if profile is None:
+        return fun(*args, **kwargs)
+    value, profile[group][name] = util._measure(fun, *args, **kwargs)
+    return value
+
+
+def _collect(label=None, final=False, sample=None):
+    _data = configuration._session()["data"]
     boundary_number = len(_data["boundaries"]) + 1
     if label is None:
         if final:
@@ -43,19 +180,250 @@ def _collect(label=None, final=False):
             label = "INITIAL"
         else:
             label = "BOUNDARY{}".format(boundary_number)
-    boundary_data = {
-        name: collector()
-        for name, collector in configuration._cget(
-            "collectors").items()
-    }
+    profile = None
+    if configuration._cget("profile", "none") != "none":
+        profile = dict(label=label,
+                       number=boundary_number,
+                       stages=dict(),
+                       collectors=dict(),
+                       testers=dict())
+        with _data["lock"]:
+            _data["profile"].append(profile)
+    names = None if sample is None else configuration._cget(
+        "sampling")["collectors"]
+    boundary_data, timeouts, cached = _timed(profile, "stages",
+                                             "collect", _run_collectors,
+                                             profile, names)
+    _data["cached"][boundary_number - 1] = cached
     boundary_summary = dict(label=label,
                             number=boundary_number,
                             final=final,
                             data=boundary_data)
-    _data["boundaries"].append(boundary_summary)
+    if len(timeouts) > 0:
+        boundary_summary.update(timeouts=timeouts)
+    if sample is not None:
+        boundary_summary.update(sample=sample)
+    with _data["lock"]:
+        _data["boundaries"].append(boundary_summary)
     return boundary_summary
 
 
+def _fingerprint(b):
+    _data = configuration._session()["data"]
+    latest = _data["boundaries"][b]
+    previous = _previous_of(_data["boundaries"], b)
+    cached = _data["cached"].pop(b, ())
+    fingerprints = dict()
+    for name, value in latest["data"].items():
+        known = _select(previous, "fingerprints", name)
+        if name in cached and known is not None and _select(
+                previous, "data", name) is value:
+            # a cached value, no need to hash it again
+            fingerprints[name] = known
+            continue
+        fingerprint = util._fingerprint(value)
+        fingerprints[name] = None if fingerprint is None else sys.intern(
+            fingerprint)
+    # the values are hashed before the state is locked
+    with _data["lock"]:
+        store = _data["store"]
+        for name, fingerprint in fingerprints.items():
+            value = latest["data"][name]
+            known = _select(previous, "fingerprints", name)
+            reused = known is not None and _select(
+                previous, "data", name) is value
+            if reused and fingerprint != known and store.get(
+                    known) is value:
+                # changed in place (e.g. by the script) since it was stored
+                del store[known]
+            if fingerprint is None:
+                continue
+            # equal values are stored once and shared between boundaries
+            shared = store.setdefault(fingerprint, value)
+            if shared is not value:
+                latest["data"][name] = shared
+        latest.update(fingerprints=fingerprints)
+    return None
+
+
+def _run_collectors(profile=None, names=None):
+    collectors = configuration._cget("collectors")
+    if names is not None:
+        collectors = {
+            name: collector
+            for name, collector in collectors.items() if name in names
+        }
+    _data = configuration._session()["data"]
+    executors = configuration._cget("executors")
+    data, keys = _cached_values(collectors)
+    cached = set(data.keys())
+    timeouts = list()
+    if executors is None:
+        for name, collector in collectors.items():
+            if name not in data:
+                data[name] = _timed(profile, "collectors", name,
+                                    collector)
+        _cache_values(data, keys)
+        collected = {name: data[name] for name in collectors}
+        return collected, timeouts, cached
+    futures = dict()
+    running = _data["running"]
+    for name, collector in collectors.items():
+        if name in data:
+            continue
+        if name in running and not running[name].done():
+            # still running since an earlier boundary, not submitted again
+            data[name] = None
+            timeouts.append(name)
+            continue
+        executor = executors.get(name)
+        if executor is None:
+            executor = executors[name] = _start_thread(name)
+        if profile is None:
+            futures[name] = executor["submit"](collector)
+        else:
+            futures[name] = executor["submit"](util._measure, collector)
+        running[name] = futures[name]
+    timeout = configuration._cget("collect_timeout")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for name, future in futures.items():
+        remaining = None if deadline is None else max(
+            0.0, deadline - time.monotonic())
+        try:
+            value = future.result(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            data[name] = None
+            timeouts.append(name)
+            continue
+        if profile is not None:
+            value, profile["collectors"][name] = value
+        data[name] = value
+    _cache_values(data, keys, timeouts)
+    collected = {name: data[name] for name in collectors}
+    return collected, timeouts, cached
+
+
+def _cached_values(collectors):
+    # values whose invalidation key did not change are not collected
+    _data = configuration._session()["data"]
+    collector_keys = configuration._cget("collector_keys", dict())
+    cache = _data["cache"]
+    cached = dict()
+    keys = dict()
+    for name in collectors.keys():
+        if name not in collector_keys:
+            continue
+        keys[name] = collector_keys[name]()
+        if name in cache and cache[name][0] == keys[name]:
+            cached[name] = cache[name][1]
+    return cached, keys
+
+
+def _cache_values(data, keys, timeouts=()):
+    _data = configuration._session()["data"]
+    for name, key in keys.items():
+        if name not in timeouts:
+            _data["cache"][name] = (key, data[name])
+    return None
+
+
+def _start_thread(name):
+    # each collector has a daemon thread, the interpreter does not wait
+    # for a collector that is stuck when it exits
+    tasks = queue.SimpleQueue()
+
+    def _run():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return None
+            future, fun, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fun(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _submit(fun, *args):
+        future = concurrent.futures.Future()
+        tasks.put((future, fun, args))
+        return future
+
+    threading.Thread(target=_run,
+                     name="rprdcbl-{}".format(name),
+                     daemon=True).start()
+    return dict(submit=_submit,
+                shutdown=functools.partial(tasks.put, None))
+
+
+def _serve(connection):
+    # runs the collector calls sent to a collector process
+    while True:
+        try:
+            fun, args = connection.recv()
+        except EOFError:
+            return None
+        try:
+            result = (True, fun(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            connection.send(result)
+        except Exception as e:
+            # the result (or the error) could not be pickled
+            connection.send((False, Exception(str(e))))
+
+
+def _start_process(name):
+    # the process can be terminated, a stuck collector would otherwise
+    # delay the exit of the interpreter
+    connection, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve,
+                                      args=(child, ),
+                                      name="rprdcbl-{}".format(name),
+                                      daemon=True)
+    process.start()
+    child.close()
+    # the calls are sent by a thread as in the thread mode
+    thread = _start_thread(name)
+
+    def _call(fun, *args):
+        connection.send((fun, args))
+        done, result = connection.recv()
+        if not done:
+            raise result
+        return result
+
+    def _shutdown():
+        thread["shutdown"]()
+        process.terminate()
+        return None
+
+    return dict(submit=functools.partial(thread["submit"], _call),
+                shutdown=_shutdown)
+
+
+def _create_executors(mode):
+    # the threads of the collectors are started on their first use
+    if mode == "serial":
+        return None
+    executors = dict()
+    if mode == "process":
+        # started before any collector threads exist
+        executors["custom"] = _start_process("custom")
+    return executors
+
+
+def _shutdown_executors():
+    executors = configuration._cget("executors")
+    for executor in (executors or dict()).values():
+        executor["shutdown"]()
+    configuration._cset("executors", None)
+    return None
+
+
 def _select(d, *k):
     if d is None:
         return None
@@ -69,58 +437,119 @@ def _select(d, *k):
         return _select(d.get(k[0]), *k[1:])
 
 
-def _test():
-    global _data
-    if _data["boundaries"] is None or len(_data["boundaries"]) < 1:
+def _last_full(boundaries, b):
+    # the latest boundary before or at `b` that is not sampled
+    while b >= 0 and "sample" in boundaries[b]:
+        b -= 1
+    return b
+
+
+def _previous_of(boundaries, b):
+    # full boundaries are compared to the previous full boundary
+    if b < 1:
         return None
-    for b in range(0, len(_data["boundaries"])):
-        results = list()
-        latest = _data["boundaries"][b]
-        if "results" in latest.keys():
+    elif "sample" in boundaries[b]:
+        return boundaries[b - 1]
+    p = _last_full(boundaries, b - 1)
+    return boundaries[p] if p >= 0 else None
+
+
+def _test(b, budget=None, stream=None):
+    # boundaries are tested once, in order, and results are final
+    _data = configuration._session()["data"]
+    boundaries = _data["boundaries"] if stream is None else _data[
+        "workers"][stream]
+    latest = boundaries[b]
+    if "results" in latest.keys():
+        return None
+    results = list()
+    previous = _previous_of(boundaries, b)
+    if _reference_stream(stream) is None:
+        reference = None
+    elif len(_reference_stream(stream)) - 1 >= b:
+        reference = _reference_at(b, stream)
+    else:
+        results.append(
+            ("The boundary #{} does not have a corresponding " +
+             "boundary in the reference boundary.").format(b + 1))
+        reference = None
+    if reference is not None and not (latest["label"]
+                                      == reference.get("label")):
+        results.append(
+            ("The label for boundary #{} does not match the " +
+             "reference value ('{}' != '{}').").format(
+                 str(b + 1), latest["label"], reference["label"]))
+    test_funs = configuration._cget("testers")
+    collector_keys = configuration._cget("collector_keys", dict())
+    ignored = _data["reference_ignored"]
+    latest_type = "initial" if b == 0 else "default"
+    timeouts = latest.get("timeouts", list())
+    for name in timeouts:
+        results.append(
+            "The collector '{}' did not finish within {} seconds.".format(
+                name, configuration._cget("collect_timeout")))
+    profile = _profile_of(b) if stream is None else None
+    for test in test_funs.keys():
+        if test in timeouts:
             continue
-        previous = _data["boundaries"][b - 1] if (b > 0) else None
-        if _data["reference"] is None:
-            reference = None
-        elif len(_data["reference"]) - 1 >= b:
-            reference = _data["reference"][b]
+        if "sample" in latest and test not in latest["data"]:
+            # not collected for sampled boundaries
+            continue
+        test_fun = test_funs[test]
+        fingerprint = _select(latest, "fingerprints", test)
+        test_reference = None if test in ignored else reference
+        if test in collector_keys and previous is not None and _select(
+                latest, "data",
+                test) is _select(previous, "data", test) and (
+                    _reference_stream(stream) is None
+                    or fingerprint is not None and fingerprint
+                    == _select(test_reference, "fingerprints", test)):
+            # a cached value already tested at the previous boundary
+            continue
+        if fingerprint is not None and fingerprint == _select(
+                reference, "fingerprints", test) and test_fun in {
+                    testers._deep_equality_test,
+                    testers._deep_lr_equality_test
+                }:
+            # not compared, the fingerprints already match
+            reference_value = None
         else:
-            results.append(
-                "The boundary #{} does not have a corresponding " +
-                "boundary in the reference boundary.".format(b + 1))
-            reference = None
-        if reference is not None and not (latest["label"]
-                                          == reference.get("label")):
-            results.append(
-                ("The label for boundary #{} does not match the " +
-                 "reference value ('{}' != '{}').").format(
-                     str(b + 1), latest["label"], reference["label"]))
-        testers = configuration._cget("testers")
-        latest_type = "initial" if b == 0 else "default"
-        for test in testers.keys():
-            test_fun = testers[test]
-            test_results = test_fun(_select(latest, "data", test),
-                                    _select(previous, "data", test),
-                                    _select(reference, "data", test),
-                                    _name=test,
-                                    _latest_type=latest_type)
-            if isinstance(test_results, str):
-                results.append(test_results)
-            elif isinstance(test_results, list):
-                results.extend(test_results)
-            elif test_results is not None:
-                raise Exception(
-                    "An unexpected test result was found for {}".format(
-                        test))
-        _data["boundaries"][b].update({
-            "results": [
-                result for result in results
-                if result is not None and len(result) > 0
-            ]
-        })
-    _data["failing"] = any([
-        len(boundary.get("results", [])) > 0
-        for boundary in _data["boundaries"]
-    ])
+            reference_value = _reference_value(test_reference, test)
+        test_results = _timed(
+            profile,
+            "testers",
+            test,
+            test_fun,
+            _select(latest, "data", test),
+            _select(previous, "data", test),
+            reference_value,
+            _name=test,
+            _latest_type=latest_type,
+            _budget=budget,
+            _tolerance=configuration._cget("tolerances",
+                                           dict()).get(test),
+            _fingerprints=(fingerprint,
+                           _select(previous, "fingerprints", test),
+                           _select(test_reference, "fingerprints",
+                                   test)))
+        if isinstance(test_results, str):
+            results.append(test_results)
+        elif isinstance(test_results, list):
+            results.extend(test_results)
+        elif test_results is not None:
+            raise Exception(
+                "An unexpected test result was found for {}".format(test))
+    results = [
+        result for result in results
+        if result is not None and len(result) > 0
+    ]
+    with _data["lock"]:
+        latest.update(results=results)
+        if len(results) > 0:
+            # failures only lists boundaries of the session itself
+            if stream is None:
+                _data["failures"].append(latest["number"])
+            _data["failing"] = True
     return None
 
 
@@ -152,30 +581,273 @@ def _load_lock_file():
     if fname is None or not os.path.exists(fname):
         return None
 
-    with open(fname, "rb") as fh:
-        loaded_data = pickle.load(fh)
-    if not isinstance(loaded_data, dict):
-        raise Exception("Unexpected data in lock file.")
-    global _data
+    _data = configuration._session()["data"]
+    # the indexed format is decoded lazily, see `_reference_value`
+    lock = storage._open_indexed(fname)
+    if lock is not None:
+        _data["lock_file"] = lock
+        _data["reference"] = lock["boundaries"]
+        _data["reference_workers"] = lock["workers"]
+        _data["reference_sampling"] = lock["sampling"]
+        return None
+    loaded_data = storage._load_pickle(fname)
     _data["reference"] = loaded_data["boundaries"]
+    _data["reference_workers"] = loaded_data.get("workers", dict())
+    _data["reference_sampling"] = loaded_data.get("sampling")
+    return None
+
+
+def _select_stored_reference(directory):
+    # the lock file of the closest run is loaded as usual
+    _data = configuration._session()["data"]
+    # the store is opened first, its modules are part of the key
+    storage._open_store(directory).close()
+    data, timeouts, cached = _run_collectors(names=storage._store_keys)
+    key = {
+        name: util._fingerprint(data.get(name))
+        for name in storage._store_keys
+    }
+    _data["store_key"] = key
+    found = storage._find_run(directory, key)
+    if found is None:
+        return None
+    fname, run_key = found
+    _data["store_match"] = run_key == key
+    # the environment of a closer run is not expected to match
+    _data["reference_ignored"] = {
+        name
+        for name in storage._store_keys if key[name] != run_key[name]
+    }
+    configuration._cset("lock_file", fname)
+    return None
+
+
+def _reference_stream(stream=None):
+    _data = configuration._session()["data"]
+    if stream is None or _data["reference"] is None:
+        return _data["reference"]
+    # workers missing from the reference have an empty stream
+    return _data["reference_workers"].setdefault(stream, list())
+
+
+def _reference_at(b, stream=None):
+    _data = configuration._session()["data"]
+    reference = _reference_stream(stream)
+    if reference is None or not 0 <= b < len(reference):
+        return None
+    if _data["lock_file"] is not None and "blobs" not in reference[b]:
+        reference[b] = storage._index_boundary(_data["lock_file"],
+                                               reference[b])
+    return reference[b]
+
+
+def _boundary_at(source, b):
+    _data = configuration._session()["data"]
+    if source is _data["reference"]:
+        return _reference_at(b)
+    return source[b]
+
+
+def _decoded(blob):
+    # blobs are shared between boundaries, so are their decoded values
+    _data = configuration._session()["data"]
+    decoded = _data["decoded"]
+    if blob[0] not in decoded:
+        decoded.setdefault(
+            blob[0], storage._load_value(_data["lock_file"], blob))
+    return decoded[blob[0]]
+
+
+def _reference_value(reference, name):
+    if reference is None or "blobs" not in reference:
+        return _select(reference, "data", name)
+    elif name not in reference["blobs"]:
+        return None
+    return _decoded(reference["blobs"][name])
+
+
+def _reference_boundary(reference, collectors=None, results_only=False):
+    # decodes the selected values of a lazily loaded reference boundary
+    if reference is None or "blobs" not in reference:
+        return reference
+    boundary = {
+        k: v
+        for k, v in reference.items()
+        if k not in {"blobs", "results_blob"}
+    }
+    if reference["results_blob"] is None:
+        boundary["results"] = list()
+    else:
+        boundary["results"] = _decoded(reference["results_blob"])
+    if results_only:
+        return boundary
+    boundary["data"] = {
+        name: _reference_value(reference, name)
+        for name in reference["blobs"].keys()
+        if collectors is None or name in collectors
+    }
+    return boundary
+
+
+def _close_lock_file():
+    _data = configuration._session()["data"]
+    if _data.get("lock_file") is not None:
+        storage._close_indexed(_data["lock_file"])
+        _data["lock_file"] = None
+        _data["decoded"].clear()
     return None
 
 
 def _save_lock_file():
-    global _data
+    _data = configuration._session()["data"]
     fname = configuration._cget("lock_file")
+    store = configuration._cget("reference_store")
     if _failure_detected(force=True):
         return None
     if not _data["finalized"]:
         raise Exception(
             "The lock file cannot be saved prior to finalization.")
-    if fname is None or os.path.exists(fname):
+    if store is not None:
+        # a run is only added for environments without a run
+        if _data["store_match"]:
+            return None
+    elif fname is None or os.path.exists(fname):
         return None
-    if _data["reference"] is not None:
+    elif _data["reference"] is not None:
         return None
-    save_data = dict(boundaries=_data["boundaries"])
-    with open(fname, "wb") as fh:
-        pickle.dump(save_data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    if configuration._cget("keep_data", True):
+        boundaries = _data["boundaries"]
+    else:
+        boundaries = _journaled_boundaries()
+    if store is not None:
+        storage._add_run(store, _data["store_key"], boundaries,
+                         _data["workers"],
+                         configuration._cget("sampling"))
+        return None
+    if configuration._cget("lock_format") == "indexed":
+        storage._save_indexed(fname, boundaries, _data["workers"],
+                              configuration._cget("sampling"))
+        return None
+    storage._save_pickle(fname, boundaries, _data["workers"],
+                         configuration._cget("sampling"))
+    return None
+
+
+def _journaled_boundaries():
+    # the collected data is read back, everything else is in memory
+    _data = configuration._session()["data"]
+    journaled = list()
+    storage._read_journal(configuration._cget("journal"),
+                          journaled.append)
+    return [
+        dict(boundary, data=record["data"])
+        for boundary, record in zip(_data["boundaries"], journaled)
+    ]
+
+
+def _journal_boundary(b):
+    _data = configuration._session()["data"]
+    fh = _data["journal"]
+    latest = _data["boundaries"][b]
+    previous = _data["boundaries"][b - 1] if (b > 0) else None
+    sync = configuration._cget("journal_sync")
+    storage._append_record(fh,
+                           storage._journal_record(latest, previous),
+                           sync=(sync == "boundary"))
+    if latest["final"] and sync == "final":
+        storage._sync_journal(fh)
+    return None
+
+
+def _close_journal():
+    _data = configuration._session()["data"]
+    if _data.get("journal") is not None:
+        _data["journal"].close()
+        _data["journal"] = None
+    return None
+
+
+def _drop_data(b):
+    # only the latest (full) boundary is needed for testing the next one
+    _data = configuration._session()["data"]
+    if configuration._cget("keep_data", True) or b < 1:
+        return None
+    with _data["lock"]:
+        boundaries = _data["boundaries"]
+        keep = {b, _last_full(boundaries, b)}
+        for p in {b - 1, _last_full(boundaries, b - 1)} - keep:
+            if p >= 0:
+                boundaries[p].pop("data", None)
+        latest = boundaries[b]
+        _data["store"] = {
+            fingerprint: latest["data"][name]
+            for name, fingerprint in latest["fingerprints"].items()
+            if fingerprint is not None
+        }
+        _data["views"].clear()
+    return None
+
+
+def _start_journal(resume=False):
+    _data = configuration._session()["data"]
+    fname = configuration._cget("journal")
+    if fname is None:
+        return None
+    if not (resume and os.path.exists(fname)):
+        _data["journal"] = storage._open_journal(fname)
+        _data["finalizers"].append(_close_journal)
+        return None
+    restored = list()
+    offset = storage._read_journal(fname, restored.append)
+    _data["journal"] = storage._open_journal(fname, offset)
+    _data["finalizers"].append(_close_journal)
+    for boundary in restored:
+        if "sample" in boundary:
+            _advance_sample(*boundary["sample"])
+        with _data["lock"]:
+            for name, fingerprint in boundary.get("fingerprints",
+                                                  dict()).items():
+                if fingerprint is not None:
+                    _data["store"].setdefault(fingerprint,
+                                              boundary["data"][name])
+            _data["boundaries"].append(boundary)
+            if configuration._cget("profile", "none") != "none":
+                _data["profile"].append(
+                    dict(label=boundary["label"],
+                         number=boundary["number"],
+                         stages=dict(),
+                         collectors=dict(),
+                         testers=dict()))
+    for b in range(0, len(restored)):
+        _test(b)
+        _drop_data(b)
+    if len(restored) > 0 and restored[-1]["final"]:
+        # the run may have ended before the lock file was saved, the
+        # session is completed as after its final boundary
+        _data["finalized"] = True
+        try:
+            _save_lock_file()
+        finally:
+            _run_finalizers()
+    return None
+
+
+def _is_resumed():
+    _data = configuration._session()["data"]
+    return len(_data["boundaries"]) > 0
+
+
+def _registered_generators():
+    generators = configuration._cget("generators")
+    if generators is None:
+        generators = configuration._cset("generators", dict())
+    return generators
+
+
+def _register_generator(generator, name):
+    if not isinstance(name, str):
+        raise Exception("The name of a PRNG must be a string.")
+    _registered_generators()[name] = generator
     return None
 
 
@@ -183,58 +855,439 @@ def _configure_testing(output_mode="pretty",
                        lock_file=None,
                        failing="never",
                        custom_collect=None,
-                       custom_test=None):
-    if output_mode not in {"pretty", "parsable"}:
+                       custom_test=None,
+                       module_tracking="full",
+                       collect_mode="serial",
+                       collect_timeout=None,
+                       asynchronous=False,
+                       profile="none",
+                       prng="full",
+                       tolerances=None,
+                       journal=None,
+                       journal_sync="boundary",
+                       keep_data=True,
+                       resume=False,
+                       lock_format="indexed",
+                       global_tracking="names",
+                       global_size_limit=None,
+                       global_large="skip",
+                       hash_threads=0,
+                       report_to=None,
+                       sample_mode="every",
+                       sample_rate=1,
+                       sample_collectors=("PRNG", "PRNG_NumPy",
+                                          "custom"),
+                       custom_collect_key=None,
+                       reference_store=None,
+                       performance="none",
+                       performance_tolerance=None,
+                       track_files=None,
+                       file_cache=None):
+    if output_mode not in {"pretty", "parsable", "jsonl"}:
         raise Exception("`{}` is not a valid output mode.".format(
             str(output_mode)))
     if failing not in {"never", "early", "late"}:
         raise Exception("`{}` is not a valid failing mode.".format(
             str(failing)))
+    if module_tracking not in {"full", "incremental"}:
+        raise Exception(
+            "`{}` is not a valid module tracking mode.".format(
+                str(module_tracking)))
+    if collect_mode not in {"serial", "thread", "process"}:
+        raise Exception("`{}` is not a valid collection mode.".format(
+            str(collect_mode)))
+    if collect_timeout is not None and collect_mode == "serial":
+        raise Exception(
+            "`collect_timeout` requires the thread or process " +
+            "collection mode.")
+    if collect_mode == "process":
+        try:
+            pickle.dumps(custom_collect)
+        except Exception:
+            raise Exception(
+                "`custom_collect` must be picklable for the " +
+                "process collection mode.")
+    if profile not in {"none", "time", "memory"}:
+        raise Exception("`{}` is not a valid profiling mode.".format(
+            str(profile)))
+    if prng not in {"full", "digest"}:
+        raise Exception(
+            "`{}` is not a valid PRNG tracking mode.".format(str(prng)))
+    tolerances = dict(tolerances or dict())
+    for name, tolerance in tolerances.items():
+        if name not in set(collectors._default_collectors().keys()) | {
+                "PRNG_NumPy", "custom"
+        }:
+            raise Exception(
+                "`{}` is not a valid collector name.".format(str(name)))
+        if not isinstance(tolerance, dict) or not all(
+                k in {"rtol", "atol"} and isinstance(v, (
+                    int, float)) and v >= 0
+                for k, v in tolerance.items()):
+            raise Exception(
+                ("`{}` is not a valid tolerance (a dict " +
+                 "with non-negative `rtol` and `atol`).").format(
+                     str(tolerance)))
+    if performance not in {"none", "time", "memory"}:
+        raise Exception(
+            "`{}` is not a valid performance tracking mode.".format(
+                str(performance)))
+    performance_tolerance = dict(performance_tolerance or dict())
+    for field, tolerance in performance_tolerance.items():
+        if field not in testers._performance_tolerance.keys():
+            raise Exception(
+                "`{}` is not a valid performance field.".format(
+                    str(field)))
+        if not isinstance(tolerance, dict) or not all(
+                k in {"rtol", "atol"} and isinstance(v, (
+                    int, float)) and v >= 0
+                for k, v in tolerance.items()):
+            raise Exception(
+                ("`{}` is not a valid tolerance (a dict " +
+                 "with non-negative `rtol` and `atol`).").format(
+                     str(tolerance)))
+    if isinstance(track_files, str) or not all(
+            isinstance(pattern, str)
+            for pattern in (track_files or [])):
+        raise Exception(
+            "`track_files` must be a list of file names or patterns.")
+    if file_cache is not None and not track_files:
+        raise Exception("`file_cache` requires `track_files`.")
+    if lock_format not in {"indexed", "pickle"}:
+        raise Exception("`{}` is not a valid lock file format.".format(
+            str(lock_format)))
+    if global_tracking not in {"names", "values"}:
+        raise Exception(
+            "`{}` is not a valid global tracking mode.".format(
+                str(global_tracking)))
+    if global_large not in {"skip", "sample"}:
+        raise Exception(
+            "`{}` is not a valid mode for large global values.".format(
+                str(global_large)))
+    if not isinstance(hash_threads, int) or hash_threads < 0:
+        raise Exception("`hash_threads` must be a non-negative integer.")
+    if sample_mode not in {"every", "interval", "backoff"}:
+        raise Exception("`{}` is not a valid sampling mode.".format(
+            str(sample_mode)))
+    if sample_mode == "every" and not (isinstance(sample_rate, int)
+                                       and sample_rate >= 1):
+        raise Exception(
+            "`sample_rate` must be a positive integer for the every " +
+            "sampling mode.")
+    if sample_mode == "interval" and not (isinstance(
+            sample_rate, (int, float)) and sample_rate > 0):
+        raise Exception(
+            "`sample_rate` must be a positive number of seconds for " +
+            "the interval sampling mode.")
+    if sample_mode == "backoff" and not (isinstance(
+            sample_rate, (int, float)) and sample_rate > 1):
+        raise Exception(
+            "`sample_rate` must be a factor greater than 1 for the " +
+            "backoff sampling mode.")
+    for name in sample_collectors:
+        if name not in set(collectors._default_collectors().keys()) | {
+                "PRNG_NumPy", "custom", "global_values"
+        }:
+            raise Exception(
+                "`{}` is not a valid collector name.".format(str(name)))
+    if not (custom_collect_key is None or custom_collect_key == "static"
+            or callable(custom_collect_key)):
+        raise Exception(
+            ("`{}` is not a valid collector key (None, \"static\" " +
+             "or a function).").format(str(custom_collect_key)))
+    if journal_sync not in {"boundary", "final", "never"}:
+        raise Exception(
+            "`{}` is not a valid journal synchronization mode.".format(
+                str(journal_sync)))
+    if lock_file is not None and reference_store is not None:
+        raise Exception(
+            "`lock_file` and `reference_store` cannot be used together.")
+    if journal is None and (resume or not keep_data):
+        raise Exception(
+            "Resuming and dropping collected data require a journal.")
     if _check_state(fail=False):
         raise Exception(
             "Cannot configure pre-configured package. " +
             "Restart the interpreter to run the script again.")
 
+    reporter = printers._create_reporter(report_to)
+    _data = configuration._session()["data"]
     _reset_data()
+    configuration._cset(
+        "worker_options",
+        dict(custom_collect=custom_collect,
+             module_tracking=module_tracking,
+             prng=prng,
+             global_tracking=global_tracking,
+             global_size_limit=global_size_limit,
+             global_large=global_large,
+             sample_mode=sample_mode,
+             sample_rate=sample_rate,
+             sample_collectors=sample_collectors,
+             custom_collect_key=custom_collect_key,
+             performance=performance,
+             performance_tolerance=performance_tolerance,
+             track_files=track_files,
+             file_cache=file_cache))
     configuration._cset("__MAGIC",
                         "a81c87e5-1f5d-44c9-8c5f-eada05868816")
     configuration._cset("output_mode", output_mode)
+    configuration._cset("reporter", reporter)
+    _data["finalizers"].append(reporter["close"])
     configuration._cset("failing", failing)
     configuration._cset("lock_file", lock_file)
+    configuration._cset("reference_store", reference_store)
+    configuration._cset("lock_format", lock_format)
+    configuration._cset("profile", profile)
+    configuration._cset("tolerances", tolerances)
+    configuration._cset("journal", journal)
+    configuration._cset("journal_sync", journal_sync)
+    configuration._cset("keep_data", keep_data)
+    if "memory" in {profile, performance
+                    } and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _data["finalizers"].append(tracemalloc.stop)
     configuration._cset("custom_collect",
                         _self_or_noop(custom_collect, "custom_collect"))
     configuration._cset("custom_test",
                         _self_or_noop(custom_test, "custom_test"))
 
     _collectors = collectors._default_collectors()
+    _collectors["PRNG_NumPy"] = collectors._prng_objects_collector(
+        _registered_generators(), digest=(prng == "digest"))
+    if prng == "digest":
+        _collectors["PRNG"] = collectors._collect_prng_digest
     _collectors["custom"] = configuration._cget("custom_collect")
+    collector_keys = collectors._default_collector_keys()
+    # a single finder records the imports for the modules collector
+    if module_tracking == "incremental":
+        _collectors["modules"], collector_keys["modules"], remove_hook = \
+            collectors._incremental_modules_collector()
+    else:
+        collector_keys["modules"], remove_hook = collectors._modules_key(
+        )
+    _data["finalizers"].append(remove_hook)
+    if custom_collect_key == "static":
+        collector_keys["custom"] = collectors._static_key
+    elif custom_collect_key is not None:
+        collector_keys["custom"] = custom_collect_key
+    hash_executor = None
+    if hash_threads > 0 and (global_tracking == "values" or track_files):
+        hash_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=hash_threads, thread_name_prefix="rprdcbl-hash")
+        _data["finalizers"].append(hash_executor.shutdown)
+    if global_tracking == "values":
+        _collectors["global_values"] = \
+            collectors._global_values_collector(
+                size_limit=global_size_limit,
+                large=global_large,
+                executor=hash_executor)
+    if track_files:
+        _collectors["files"], save_cache = collectors._files_collector(
+            list(track_files),
+            cache_file=file_cache,
+            executor=hash_executor)
+        _data["finalizers"].append(save_cache)
+    if performance != "none":
+        _collectors["performance"] = collectors._performance_collector(
+            memory=(performance == "memory"))
     _testers = testers._default_testers()
-    _testers["custom"] = testers._custom_test_wrapper
+    if performance != "none":
+        _testers["performance"] = testers._performance_test
+        tolerances["performance"] = {
+            field:
+            dict(tolerance, **performance_tolerance.get(field, dict()))
+            for field, tolerance in
+            testers._performance_tolerance.items()
+        }
+    _testers["global_values"] = testers._deep_lr_equality_test
+    # input files may be written between boundaries (e.g. by a stage)
+    _testers["files"] = testers._deep_lr_equality_test
+    if custom_test is None and "custom" in tolerances:
+        # custom values may change between boundaries
+        _testers["custom"] = testers._deep_lr_equality_test
+    else:
+        _testers["custom"] = testers._custom_test_wrapper
     configuration._cset("collectors", _collectors)
+    configuration._cset("collector_keys", collector_keys)
     configuration._cset("testers", _testers)
+    configuration._cset("collect_timeout", collect_timeout)
+    configuration._cset("executors", _create_executors(collect_mode))
+    _data["finalizers"].append(_shutdown_executors)
+    configuration._cset(
+        "worker",
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rprdcbl-worker")
+        if asynchronous else None)
+    _data["finalizers"].append(_shutdown_worker)
 
+    if reference_store is not None:
+        _select_stored_reference(reference_store)
     _load_lock_file()
+    _configure_sampling(sample_mode, sample_rate, sample_collectors)
+    _start_journal(resume)
+    return None
+
+
+def _configure_sampling(mode, rate, names):
+    # a replay samples the same boundaries as its reference
+    _data = configuration._session()["data"]
+    sampling = _data["reference_sampling"] or dict(
+        mode=mode, rate=rate, collectors=sorted(names))
+    configuration._cset("sampling", sampling)
+    if _data["reference_sampling"] is not None and sampling[
+            "mode"] == "interval":
+        _data["sampled"] = {
+            tuple(boundary["sample"])
+            for boundary in _data["reference"] if "sample" in boundary
+        }
+    return None
+
+
+def _advance_sample(label, call, now=None):
+    _data = configuration._session()["data"]
+    sampling = configuration._cget("sampling")
+    state = _data["samples"].setdefault(label, dict(calls=0, due=0))
+    state.update(calls=call + 1, time=now)
+    if sampling["mode"] == "every":
+        state.update(due=call + sampling["rate"])
+    elif sampling["mode"] == "backoff":
+        state.update(due=max(call + 1, math.ceil(call *
+                                                 sampling["rate"])))
+    return None
+
+
+def _sample_due(label):
+    # returns the number of the call if it is to be sampled (or None)
+    _data = configuration._session()["data"]
+    sampling = configuration._cget("sampling")
+    state = _data["samples"].setdefault(label, dict(calls=0, due=0))
+    call = state["calls"]
+    state.update(calls=call + 1)
+    if _data["sampled"] is not None:
+        due = (label, call) in _data["sampled"]
+    elif sampling["mode"] == "interval":
+        now = time.monotonic()
+        due = state.get("time") is None or \
+            now - state["time"] >= sampling["rate"]
+    else:
+        due = call >= state["due"]
+    if not due:
+        return None
+    _advance_sample(label, call, now=time.monotonic())
+    return call
+
+
+def _complete_boundary(b, quiet=True, final=False):
+    _data = configuration._session()["data"]
+    profile = _profile_of(b)
+    _timed(profile, "stages", "fingerprint", _fingerprint, b)
+    if _data["journal"] is not None:
+        _timed(profile, "stages", "journal", _journal_boundary, b)
+    # an early failure only needs to know whether anything differs
+    budget = 1 if quiet and configuration._cget(
+        "failing") == "early" else None
+    _timed(profile, "stages", "test", _test, b, budget)
+    _drop_data(b)
+    if final:
+        _timed(profile, "stages", "save", _save_lock_file)
+    if not quiet:
+        _timed(profile,
+               "stages",
+               "print",
+               printers._print_report,
+               range(1, b + 2) if final else [b + 1],
+               boundaries=_data["boundaries"],
+               mode=configuration._cget("output_mode"),
+               reporter=configuration._cget("reporter"))
+        for name, stream in (_data["workers"].items() if final else []):
+            printers._print_report(
+                boundaries=[
+                    dict(boundary,
+                         label="{}: {}".format(name, boundary["label"]))
+                    for boundary in stream
+                ],
+                mode=configuration._cget("output_mode"),
+                reporter=configuration._cget("reporter"))
+        if final and profile is not None:
+            printers._print_profile(
+                _data["profile"],
+                mode=configuration._cget("output_mode"),
+                reporter=configuration._cget("reporter"))
+    return None
+
+
+def _wait_for_pending(wait=True):
+    _data = configuration._session()["data"]
+    pending = _data.get("pending", list())
+    while len(pending) > 0 and (wait or pending[0].done()):
+        # re-raises errors from the background worker
+        pending.pop(0).result()
+    return None
+
+
+def _shutdown_worker():
+    worker = configuration._cget("worker")
+    if worker is not None:
+        worker.shutdown(wait=True)
+    configuration._cset("worker", None)
     return None
 
 
 def _process_boundary(label=None, quiet=True, final=True):
+    # concurrent boundaries of a session are passed one at a time
+    with configuration._session()["lock"]:
+        return _pass_boundary(label=label, quiet=quiet, final=final)
+
+
+def _process_sampled_boundary(label=None, quiet=True):
+    with configuration._session()["lock"]:
+        _check_state()
+        call = _sample_due(label)
+        if call is None:
+            return None
+        return _pass_boundary(label=label,
+                              quiet=quiet,
+                              final=False,
+                              sample=[label, call])
+
+
+def _pass_boundary(label=None, quiet=True, final=True, sample=None):
     _check_state()
-    global _data
+    _data = configuration._session()["data"]
     if _data["finalized"]:
         raise Exception("Final boundary already reached.")
-    _collect(label=label, final=final)
-    _test()
+    try:
+        _collect_and_complete(label, quiet, final, sample)
+    finally:
+        if final:
+            # the session ends with its final boundary, even if it fails
+            _data["finalized"] = True
+            _run_finalizers()
+    return None
+
+
+def _collect_and_complete(label, quiet, final, sample):
+    _data = configuration._session()["data"]
+    worker = configuration._cget("worker")
+    if worker is not None:
+        _wait_for_pending(wait=False)
+        if "early" == configuration._cget("failing") and \
+                _failure_detected(force=True):
+            raise Exception("A reproducibility error has been detected.")
+    boundary = _collect(label=label, final=final, sample=sample)
     if final:
         _data["finalized"] = True
-        _save_lock_file()
-    if not quiet:
-        boundary_number = len(_data["boundaries"])
-        if boundary_number < 1:
-            raise Exception("Unexpected state detected.")
-        printers._print_report(
-            range(1, boundary_number) if final else boundary_number,
-            boundaries=_data["boundaries"],
-            mode=configuration._cget("output_mode"))
+    if worker is None:
+        _complete_boundary(boundary["number"] - 1, quiet, final)
+    else:
+        _data["pending"].append(
+            worker.submit(configuration._in_session,
+                          configuration._session(), _complete_boundary,
+                          boundary["number"] - 1, quiet, final))
+        if not final:
+            return None
+        _wait_for_pending(wait=True)
     fail_now = ("early" == configuration._cget("failing")) or \
                (final and ("never" != configuration._cget("failing")))
     if fail_now and _failure_detected(force=True):
@@ -242,8 +1295,90 @@ def _process_boundary(label=None, quiet=True, final=True):
     return None
 
 
+def _close_session(session):
+    # ends a session before its final boundary, see `close_session`
+    with configuration._use_session(session):
+        _data = configuration._session()["data"]
+        with session["lock"]:
+            if not _check_state(fail=False):
+                return None
+            _data["finalized"] = True
+            try:
+                _wait_for_pending(wait=True)
+            except Exception:
+                # the results of a closed session are not reported
+                pass
+            _run_finalizers()
+    return None
+
+
+def _worker_configuration():
+    _check_state()
+    return dict(configuration._cget("worker_options"))
+
+
+def _start_worker(options, name, generators=None):
+    configuration._use_session(configuration._new_session())
+    for generator_name, generator in (generators or dict()).items():
+        _register_generator(generator, generator_name)
+    _configure_testing(**options)
+    # worker boundaries are only collected, the parent tests them
+    configuration._cset("testers", dict())
+    configuration._cset("worker_name", name)
+    _process_boundary(label=None, quiet=True, final=False)
+    return None
+
+
+def _finish_worker(label=None):
+    _data = configuration._session()["data"]
+    name = configuration._cget("worker_name")
+    if name is None:
+        raise Exception("The session is not a worker session.")
+    _process_boundary(label=label, quiet=True, final=True)
+    boundaries = _data["boundaries"]
+    return dict(name=name,
+                boundaries=[
+                    storage._journal_record(
+                        boundary, boundaries[b - 1] if b > 0 else None)
+                    for b, boundary in enumerate(boundaries)
+                ])
+
+
+def _merge_worker(stream):
+    _check_state()
+    _data = configuration._session()["data"]
+    with configuration._session()["lock"]:
+        if _data["finalized"]:
+            raise Exception(
+                "Workers must be merged before the final boundary.")
+        name = stream["name"]
+        if name in _data["workers"]:
+            raise Exception(
+                "The worker `{}` has already been merged.".format(name))
+        boundaries = list()
+        for record in stream["boundaries"]:
+            boundaries.append(
+                storage._restore_record(
+                    record,
+                    boundaries[-1] if len(boundaries) > 0 else None))
+        # the state lock is held by `_copy_state` (the session lock only
+        # orders the boundaries)
+        with _data["lock"]:
+            _data["workers"][name] = boundaries
+        for b in range(0, len(boundaries)):
+            _test(b, stream=name)
+    return None
+
+
 def _reset_all_for_testing_only():
-    global _data
+    _data = configuration._session()["data"]
+    try:
+        _wait_for_pending(wait=True)
+    except Exception:
+        pass
+    _run_finalizers()
+    if len(_data) > 0:
+        _close_lock_file()
     _data.clear()
-    configuration._configuration.clear()
+    configuration._session()["configuration"].clear()
     return None
@@ -0,0 +1,437 @@
+import base64
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import warnings
+
+__journal_magic = b"RPRDCBL-JOURNAL-1\n"
+__lock_magic = b"RPRDCBL-LOCK-1\n"
+__record_header = struct.Struct("<Q")
+
+
+def _open_journal(fname, offset=None):
+    """Opens a journal for appending records.
+
+    A new journal is created unless an `offset` (the end of the valid
+    records as returned by `_read_journal`) is given, in which case any
+    incomplete record after it is discarded.
+    """
+    if offset is None:
+        fh = open(fname, "wb")
+        fh.write(__journal_magic)
+        fh.flush()
+    else:
+        fh = open(fname, "r+b")
+        fh.truncate(offset)
+        fh.seek(offset)
+    return fh
+
+
+def _append_record(fh, record, sync=False):
+    """Appends a boundary record to a journal.
+
+    The record is flushed to the operating system so that it survives
+    the termination of the process, and to the storage device if `sync`
+    is true.
+    """
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    fh.write(__record_header.pack(len(payload)) + payload)
+    fh.flush()
+    if sync:
+        os.fsync(fh.fileno())
+    return None
+
+
+def _sync_journal(fh):
+    """Flushes a journal to the storage device."""
+    fh.flush()
+    os.fsync(fh.fileno())
+    return None
+
+
+def _read_journal(fname, callback):
+    """Reads the boundaries recorded in a journal.
+
+    The callback is called with each boundary (in order). Values that
+    were recorded as unchanged are restored from the previous boundary.
+    Reading stops at the first incomplete record (e.g. one that was
+    being written when the process was terminated). Returns the offset
+    of the end of the last complete record.
+    """
+    with open(fname, "rb") as fh:
+        if fh.read(len(__journal_magic)) != __journal_magic:
+            raise Exception("`{}` is not a journal.".format(fname))
+        offset = fh.tell()
+        previous = None
+        while True:
+            header = fh.read(__record_header.size)
+            if len(header) < __record_header.size:
+                break
+            size = __record_header.unpack(header)[0]
+            payload = fh.read(size)
+            if len(payload) < size:
+                break
+            try:
+                record = pickle.loads(payload)
+            except Exception:
+                break
+            offset = fh.tell()
+            boundary = _restore_record(record, previous)
+            callback(boundary)
+            previous = boundary
+    return offset
+
+
+def _journal_record(boundary, previous=None):
+    """Returns the journal record of a boundary.
+
+    Collected values that are the same objects as in the previous
+    boundary are only recorded as unchanged. Test results are not
+    recorded.
+    """
+    record = {
+        k: v
+        for k, v in boundary.items() if k not in {"data", "results"}
+    }
+    data = dict()
+    unchanged = list()
+    previous_data = dict() if previous is None else previous.get(
+        "data", dict())
+    for name, value in boundary["data"].items():
+        if name in previous_data and value is previous_data[name]:
+            data[name] = None
+            unchanged.append(name)
+        else:
+            data[name] = value
+    record.update(data=data, unchanged=unchanged)
+    return record
+
+
+def _restore_record(record, previous=None):
+    """Returns the boundary of a journal record."""
+    boundary = dict(record)
+    unchanged = boundary.pop("unchanged", list())
+    for name in unchanged:
+        boundary["data"][name] = previous["data"][name]
+    return boundary
+
+
+def _encode(value):
+    """Converts a value to tagged JSON data.
+
+    Lists, strings, numbers, booleans and None are represented as
+    themselves, all other supported values as objects with a single tag
+    (e.g. `{"t": [...]}` for tuples). Raises an exception for values
+    that cannot be represented.
+    """
+    kind = type(value)
+    if value is None or kind in {bool, int, float, str}:
+        return value
+    elif kind is list:
+        return [_encode(v) for v in value]
+    elif kind is dict:
+        return {
+            "d": [[_encode(k), _encode(v)] for k, v in value.items()]
+        }
+    elif kind is tuple:
+        return {"t": [_encode(v) for v in value]}
+    elif kind is set:
+        return {"s": [_encode(v) for v in value]}
+    elif kind is frozenset:
+        return {"f": [_encode(v) for v in value]}
+    elif kind is bytes:
+        return {"b": base64.b64encode(value).decode("ascii")}
+    elif kind is complex:
+        return {"c": [value.real, value.imag]}
+    numpy = sys.modules.get("numpy")
+    if numpy is not None and isinstance(
+            value,
+        (numpy.ndarray, numpy.generic)) and value.dtype.kind != "O":
+        return {
+            "a" if kind is numpy.ndarray else "n": [
+                value.dtype.str,
+                list(value.shape),
+                base64.b64encode(value.tobytes()).decode("ascii")
+            ]
+        }
+    raise Exception(
+        "A value of type `{}` cannot be stored in the indexed lock file format."
+        .format(kind.__name__))
+
+
+def __decode_object(tagged):
+    """Converts a tagged JSON object to its value."""
+    (tag, value), = tagged.items()
+    if tag == "d":
+        return {k: v for k, v in value}
+    elif tag == "t":
+        return tuple(value)
+    elif tag == "s":
+        return set(value)
+    elif tag == "f":
+        return frozenset(value)
+    elif tag == "b":
+        return base64.b64decode(value)
+    elif tag == "c":
+        return complex(*value)
+    elif tag in {"a", "n"}:
+        import numpy
+        array = numpy.frombuffer(base64.b64decode(value[2]),
+                                 dtype=numpy.dtype(value[0])).reshape(
+                                     value[1]).copy()
+        return array if tag == "a" else array[()]
+    raise Exception("Unexpected data in lock file.")
+
+
+def _decode(text):
+    """Converts tagged JSON text (see `_encode`) to its value."""
+    return json.loads(text, object_hook=__decode_object)
+
+
+def __blob(value):
+    """Returns the tagged JSON text of a value as bytes."""
+    return json.dumps(_encode(value),
+                      separators=(",", ":")).encode("utf-8")
+
+
+def _save_pickle(fname, boundaries, workers=None, sampling=None):
+    """Saves boundaries in the pickle lock file format."""
+    save_data = dict(boundaries=boundaries,
+                     workers=workers or dict(),
+                     sampling=sampling)
+    with open(fname, "wb") as fh:
+        pickle.dump(save_data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    return None
+
+
+def _load_pickle(fname):
+    """Loads a lock file in the pickle format.
+
+    Loading a pickle may run arbitrary code, so a warning is issued each
+    time. Lock files of this format must come from a trusted source.
+    """
+    warnings.warn(
+        "The lock file `{}` is read in the pickle format, which "
+        "is only safe for trusted files.".format(fname))
+    with open(fname, "rb") as fh:
+        loaded_data = pickle.load(fh)
+    if not isinstance(loaded_data, dict):
+        raise Exception(
+            "Unexpected data in lock file `{}`.".format(fname))
+    return loaded_data
+
+
+def _save_indexed(fname, boundaries, workers=None, sampling=None):
+    """Saves boundaries in the indexed lock file format.
+
+    The file starts with a header and the length of a JSON index,
+    followed by one tagged JSON blob per collected value and per
+    non-empty list of test results. Values shared between boundaries are
+    stored once. The index lists the collector names, the offset, length
+    and fingerprint of each blob (relative to the end of the index), and
+    for each boundary its label, number, finality, timeouts, and blob
+    numbers of its values and results. The boundaries of `workers` (a
+    dict of names and boundary lists) are indexed the same way, and the
+    `sampling` policy is stored in the index as well. If a value cannot
+    be represented (see `_encode`), the lock file is saved in the pickle
+    format instead and a warning is issued.
+    """
+    names = list()
+    positions = dict()
+    values = list()
+    numbers = dict()
+    blobs = list()
+
+    def _add_blob(blob, fingerprint=None):
+        offset = values[-1][0] + values[-1][1] if len(values) > 0 else 0
+        values.append([offset, len(blob), fingerprint])
+        blobs.append(blob)
+        return len(values) - 1
+
+    def _index_entry(boundary):
+        entry = dict(label=boundary["label"],
+                     number=boundary["number"],
+                     final=boundary["final"],
+                     data=[None] * len(names),
+                     results=None)
+        if "timeouts" in boundary:
+            entry["timeouts"] = boundary["timeouts"]
+        if "sample" in boundary:
+            entry["sample"] = boundary["sample"]
+        fingerprints = boundary.get("fingerprints", dict())
+        for name, value in boundary["data"].items():
+            if name not in positions:
+                positions[name] = len(names)
+                names.append(name)
+                entry["data"].append(None)
+            # an object changed in place has one fingerprint per state
+            key = (id(value), fingerprints.get(name))
+            if key not in numbers:
+                numbers[key] = _add_blob(__blob(value), key[1])
+            entry["data"][positions[name]] = numbers[key]
+        if len(boundary.get("results", list())) > 0:
+            entry["results"] = _add_blob(__blob(boundary["results"]))
+        return entry
+
+    try:
+        index = [_index_entry(boundary) for boundary in boundaries]
+        worker_index = {
+            name: [_index_entry(boundary) for boundary in stream]
+            for name, stream in (workers or dict()).items()
+        }
+        header = json.dumps(dict(version=1,
+                                 collectors=names,
+                                 values=values,
+                                 boundaries=index,
+                                 workers=worker_index,
+                                 sampling=sampling),
+                            separators=(",", ":")).encode("utf-8")
+    except Exception as e:
+        # e.g. dates or custom objects, the run must not fail on saving
+        warnings.warn(
+            "The lock file `{}` is saved in the pickle format "
+            "instead. {}".format(fname, e))
+        return _save_pickle(fname, boundaries, workers, sampling)
+    temporary = fname + ".tmp"
+    with open(temporary, "wb") as fh:
+        fh.write(__lock_magic)
+        fh.write(__record_header.pack(len(header)))
+        fh.write(header)
+        for blob in blobs:
+            fh.write(blob)
+    os.replace(temporary, fname)
+    return None
+
+
+def _open_indexed(fname):
+    """Opens a lock file in the indexed format (or returns None).
+
+    Only the index is read. Returns a dict with the (unexpanded)
+    boundaries of the index and of each worker, the sampling policy, and
+    the memory-mapped blobs. Boundaries are expanded with `_index_boundary`.
+    """
+    with open(fname, "rb") as fh:
+        if fh.read(len(__lock_magic)) != __lock_magic:
+            return None
+        size = __record_header.unpack(fh.read(__record_header.size))[0]
+        index = json.loads(fh.read(size))
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if index.get("version") != 1:
+        raise Exception("Unexpected lock file version.")
+    return dict(boundaries=index["boundaries"],
+                workers=index.get("workers", dict()),
+                sampling=index.get("sampling"),
+                collectors=index["collectors"],
+                values=index["values"],
+                mapped=mapped,
+                start=len(__lock_magic) + __record_header.size + size)
+
+
+def _index_boundary(lock, entry):
+    """Expands a boundary of the index of an indexed lock file.
+
+    Instead of their data (and test results), expanded boundaries hold
+    the `blobs` (and `results_blob`) to be decoded with `_load_value`.
+    """
+    values = lock["values"]
+    boundary = {
+        k: v
+        for k, v in entry.items() if k not in {"data", "results"}
+    }
+    blobs = dict()
+    fingerprints = dict()
+    for name, number in zip(lock["collectors"], entry["data"]):
+        if number is not None:
+            blobs[name] = values[number]
+            fingerprints[name] = values[number][2]
+    boundary.update(blobs=blobs,
+                    fingerprints=fingerprints,
+                    results_blob=None if entry["results"] is None else
+                    values[entry["results"]])
+    return boundary
+
+
+def _load_value(lock, blob):
+    """Decodes a blob (offset, length) of an indexed lock file."""
+    offset = lock["start"] + blob[0]
+    return _decode(lock["mapped"][offset:offset + blob[1]])
+
+
+def _close_indexed(lock):
+    """Closes an indexed lock file."""
+    lock["mapped"].close()
+    return None
+
+
+# the collectors identifying the environment of a run, in the order of
+# their importance for selecting a reference run
+_store_keys = ("version", "platform", "os", "modules")
+
+
+def _open_store(directory):
+    """Opens (and creates) the index database of a reference store.
+
+    A reference store is a directory of lock files (in the indexed
+    format) and an SQLite database indexing them by the fingerprints of
+    the `_store_keys` collectors.
+    """
+    import sqlite3
+    os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(directory,
+                                              "index.sqlite"),
+                                 timeout=60)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, " +
+        ", ".join("{} TEXT".format(name) for name in _store_keys) +
+        ", lock_file TEXT NOT NULL)")
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS runs_by_key ON runs ({})".format(
+            ", ".join(_store_keys)))
+    return connection
+
+
+def _find_run(directory, key):
+    """Returns the lock file and key of the closest run in a store.
+
+    `key` is a dict of the fingerprints of the `_store_keys` collectors.
+    The latest run with the same key is selected, otherwise the latest
+    run matching the longest prefix of `_store_keys` (using the index)
+    or any run. Returns None for an empty store.
+    """
+    connection = _open_store(directory)
+    try:
+        for n in range(len(_store_keys), -1, -1):
+            condition = " AND ".join("{} = ?".format(name)
+                                     for name in _store_keys[:n])
+            row = connection.execute(
+                ("SELECT lock_file, {} FROM runs {} ORDER BY id DESC " +
+                 "LIMIT 1").format(
+                     ", ".join(_store_keys),
+                     "WHERE " + condition if n > 0 else ""),
+                [key[name] for name in _store_keys[:n]]).fetchone()
+            if row is not None:
+                return os.path.join(directory, row[0]), dict(
+                    zip(_store_keys, row[1:]))
+        return None
+    finally:
+        connection.close()
+
+
+def _add_run(directory, key, boundaries, workers=None, sampling=None):
+    """Adds a run to a reference store (see `_save_indexed`)."""
+    fname = "{}.lock".format(os.urandom(16).hex())
+    connection = _open_store(directory)
+    try:
+        _save_indexed(os.path.join(directory, fname), boundaries,
+                      workers, sampling)
+        with connection:
+            connection.execute(
+                "INSERT INTO runs ({}, lock_file) VALUES ({}?)".format(
+                    ", ".join(_store_keys), "?, " * len(_store_keys)),
+                [key[name] for name in _store_keys] + [fname])
+    finally:
+        connection.close()
+    return None
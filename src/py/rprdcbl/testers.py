@@ -9,27 +9,43 @@ def _deep_equality_test(latest,
                         _latest_type="latest",
                         _name="",
                         _ignore_previous=False,
-                        _ignore_reference=False):
-    """Compares the latest data to the previous and reference data."""
+                        _ignore_reference=False,
+                        _fingerprints=None,
+                        _budget=None,
+                        _tolerance=None):
+    """Compares the latest data to the previous and reference data.
+
+    Comparisons are skipped if the fingerprints (latest, previous,
+    reference) show that the values are equal. Numbers and arrays are
+    compared with the `_tolerance` (if any). Returns difference records
+    (at most `_budget` for each comparison).
+    """
     _name = _name or ""
+    latest_fp, previous_fp, reference_fp = _fingerprints or (None, None,
+                                                             None)
+    if latest_fp is not None:
+        _ignore_previous = _ignore_previous or latest_fp == previous_fp
+        _ignore_reference = _ignore_reference or latest_fp == reference_fp
     if _ignore_previous:
         previous_results = list()
     else:
-        previous_results = list(
-            util.__deep_compare(latest,
-                                previous,
-                                _x=_latest_type,
-                                _y="previous",
-                                _prefix=_name) or list())
+        previous_results = util._diff(latest,
+                                      previous,
+                                      _x=_latest_type,
+                                      _y="previous",
+                                      _prefix=_name,
+                                      _budget=_budget,
+                                      _tolerance=_tolerance)
     if _ignore_reference:
         reference_results = list()
     else:
-        reference_results = list(
-            util.__deep_compare(latest,
-                                reference,
-                                _x=_latest_type,
-                                _y="reference",
-                                _prefix=_name) or list())
+        reference_results = util._diff(latest,
+                                       reference,
+                                       _x=_latest_type,
+                                       _y="reference",
+                                       _prefix=_name,
+                                       _budget=_budget,
+                                       _tolerance=_tolerance)
     return previous_results + reference_results
 
 
@@ -37,14 +53,20 @@ def _deep_lr_equality_test(latest,
                            previous,
                            reference,
                            _latest_type="latest",
-                           _name=""):
+                           _name="",
+                           _fingerprints=None,
+                           _budget=None,
+                           _tolerance=None):
     """Compares the latest data to the reference data."""
     return _deep_equality_test(latest=latest,
                                previous=previous,
                                reference=reference,
                                _latest_type=_latest_type,
                                _name=_name,
-                               _ignore_previous=True)
+                               _ignore_previous=True,
+                               _fingerprints=_fingerprints,
+                               _budget=_budget,
+                               _tolerance=_tolerance)
 
 
 def _custom_test_wrapper(latest,
@@ -52,7 +74,10 @@ def _custom_test_wrapper(latest,
                          reference,
                          _latest_type="latest",
                          _name="",
-                         _fun=None):
+                         _fun=None,
+                         _fingerprints=None,
+                         _budget=None,
+                         _tolerance=None):
     """Special wrapper for the custom test function."""
     _name = _name or ""
     if _fun is None:
@@ -68,6 +93,48 @@ def _custom_test_wrapper(latest,
         return result
 
 
+# the default tolerances of the resources used between boundaries
+_performance_tolerance = dict(wall=dict(rtol=0.5, atol=0.1),
+                              cpu=dict(rtol=0.5, atol=0.1),
+                              rss=dict(rtol=0.5, atol=64 * 2**20),
+                              memory=dict(rtol=0.5, atol=16 * 2**20))
+
+
+def _performance_test(latest,
+                      previous,
+                      reference,
+                      _latest_type="latest",
+                      _name="",
+                      _fingerprints=None,
+                      _budget=None,
+                      _tolerance=None):
+    """Compares the resources used to the reference.
+
+    A field is reported if it exceeds the reference value by more than
+    its tolerance (`_tolerance` is a dict of fields and dicts with
+    `rtol` and `atol`), i.e. if it is greater than `reference * (1 +
+    rtol) + atol`. Lower values are never reported.
+    """
+    results = list()
+    if not isinstance(latest, dict) or not isinstance(reference, dict):
+        return results
+    for field, observed in latest.items():
+        expected = reference.get(field)
+        if observed is None or expected is None:
+            continue
+        tolerance = (_tolerance or dict()).get(field, dict())
+        if observed > expected * (1 + tolerance.get("rtol", 0)) + \
+                tolerance.get("atol", 0):
+            results.append(
+                dict(kind="performance",
+                     path="{}.{}".format(_name, field),
+                     x=_latest_type,
+                     y="reference",
+                     observed=observed,
+                     expected=expected))
+    return results if _budget is None else results[:_budget]
+
+
 def _default_testers():
     """Returns all default testing functions."""
     testers = {
@@ -75,5 +142,6 @@ def _default_testers():
         for k in collectors._default_collectors().keys()
     }
     testers["PRNG"] = _deep_lr_equality_test
+    testers["PRNG_NumPy"] = _deep_lr_equality_test
     testers["global_names"] = _deep_lr_equality_test
     return testers
@@ -1,3 +1,489 @@
+import cmath
+import hashlib
+import marshal
+import pickle
+import time
+import tracemalloc
+import types
+
+
+def _fingerprint(value):
+    """Returns a stable content hash of a value (or None).
+
+    The hash is computed over the `marshal` serialization of builtin data
+    types and over the buffers of arrays (with their type, format and
+    shape). None is returned for values containing anything else. Equal
+    fingerprints imply equal values, different fingerprints do not imply
+    different values.
+    """
+    digest = hashlib.sha1()
+    if not __digest_update(digest, value):
+        return None
+    return digest.hexdigest()
+
+
+def _digest(value):
+    """Returns a fixed-size digest of a (PRNG state) value.
+
+    Values are hashed through their `marshal` serialization where
+    possible. Containers of values that cannot be serialized this way
+    are hashed element by element, and buffers such as NumPy arrays are
+    hashed in place (without conversion to other objects).
+    """
+    digest = hashlib.sha1()
+    __digest_update(digest, value)
+    return digest.hexdigest()
+
+
+# `marshal` serializes these exactly; all other buffer objects (arrays,
+# bytearrays) would be serialized as plain bytes
+__scalars = frozenset(
+    [type(None), bool, int, float, complex, str, bytes,
+     type(Ellipsis)])
+
+
+def __is_array(value):
+    """Indicates whether a value is array-like (NumPy, pandas, etc.)."""
+    return hasattr(value, "__array__") and hasattr(value, "shape")
+
+
+def __marshallable(value, _depth=1000):
+    """Indicates whether `marshal` serializes a value exactly.
+
+    Values nested deeper than `_depth` (including cyclic values) are not
+    considered serializable. Sets are not either, as their serialization
+    depends on the (randomized) string hashes of the process.
+    """
+    level = [value]
+    for depth in range(0, _depth):
+        nested = list()
+        for value in level:
+            kind = type(value)
+            if kind in __scalars:
+                continue
+            elif kind is dict:
+                elements = list(value.keys()) + list(value.values())
+            elif kind in (list, tuple):
+                elements = value
+            else:
+                return False
+            if not set(map(type, elements)) <= __scalars:
+                nested.extend(elements)
+        if len(nested) == 0:
+            return True
+        level = nested
+    return False
+
+
+def __digest_update(digest, value):
+    """Adds a value to a running digest.
+
+    Returns False if (a part of) the value was only added through its
+    `repr` and thus does not identify the value.
+    """
+    kind = type(value)
+    if __marshallable(value):
+        digest.update(marshal.dumps(value, 2))
+        return True
+    exact = True
+    if kind is dict:
+        digest.update(b"\x00{")
+        for key, element in value.items():
+            exact = __digest_update(digest, key) and exact
+            exact = __digest_update(digest, element) and exact
+        digest.update(b"\x00}")
+    elif kind in (list, tuple):
+        digest.update(b"\x00(" if kind is tuple else b"\x00[")
+        for element in value:
+            exact = __digest_update(digest, element) and exact
+        digest.update(b"\x00)" if kind is tuple else b"\x00]")
+    elif kind in (set, frozenset):
+        elements = list()
+        for element in value:
+            element_digest = hashlib.sha1()
+            exact = __digest_update(element_digest, element) and exact
+            elements.append(element_digest.digest())
+        digest.update(b"\x00{" + b"".join(sorted(elements)) + b"\x00}")
+    elif hasattr(value, "dtype") and hasattr(
+            value, "shape") and hasattr(value, "tobytes"):
+        digest.update(
+            "\x00<{}{}{}>".format(kind.__name__, value.dtype.str,
+                                  value.shape).encode("utf-8"))
+        try:
+            digest.update(memoryview(value).cast("B"))
+        except (TypeError, ValueError):
+            # not contiguous (or no buffer support)
+            digest.update(value.tobytes())
+        # the buffer of object arrays only holds references
+        exact = value.dtype.kind != "O"
+    else:
+        try:
+            view = memoryview(value)
+        except TypeError:
+            view = None
+        if view is not None and view.c_contiguous:
+            digest.update("\x00<{}{}{}>".format(
+                kind.__name__, view.format, view.shape).encode("utf-8"))
+            digest.update(view.cast("B"))
+        else:
+            digest.update(repr(value).encode("utf-8"))
+            exact = False
+    return exact
+
+
+def _plain(value):
+    """Converts arrays within a value to (nested) lists."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return type(value)(_plain(v) for v in value)
+    elif hasattr(value, "tolist") and hasattr(value, "dtype"):
+        return value.tolist()
+    return value
+
+
+def _freeze(value, _cache=None):
+    """Returns a read-only view of a value.
+
+    Dicts are returned as mapping proxies, lists and tuples as tuples, and
+    sets as frozen sets (each with read-only elements). Dicts with only
+    scalar values are wrapped without being copied. `_cache` is an
+    optional dict used to reuse the views of containers by identity.
+    """
+    if not isinstance(value, (dict, list, tuple, set)):
+        return value
+    if _cache is not None:
+        cached = _cache.get(id(value))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+    if isinstance(value, dict):
+        if all(not isinstance(v, (dict, list, tuple, set))
+               for v in value.values()):
+            view = types.MappingProxyType(value)
+        else:
+            view = types.MappingProxyType({
+                k: _freeze(v, _cache)
+                for k, v in value.items()
+            })
+    elif isinstance(value, set):
+        view = frozenset(value)
+    else:
+        view = tuple(_freeze(v, _cache) for v in value)
+    if _cache is not None:
+        _cache[id(value)] = (value, view)
+    return view
+
+
+__chunk_size = 1 << 20
+__sample_size = 1 << 16
+__sample_chunks = 16
+
+
+def __chunk_digest(chunk):
+    """Returns the digest of a chunk of a buffer."""
+    return hashlib.sha1(chunk).digest()
+
+
+def _buffer_digest(view, _executor=None, _sample=False):
+    """Returns the digest of a byte buffer, hashed in chunks.
+
+    The chunks are slices of the memory view (not copies) and are hashed
+    in parallel if an `_executor` is given. If `_sample` is true, only a
+    fixed number of evenly spaced chunks is hashed for large buffers.
+    """
+    size = view.nbytes
+    chunk = __chunk_size
+    starts = list(range(0, size, chunk))
+    sampled = _sample and size > __sample_chunks * __sample_size
+    if sampled:
+        chunk = __sample_size
+        starts = [(size - chunk) * i // (__sample_chunks - 1)
+                  for i in range(0, __sample_chunks)]
+    chunks = [view[start:start + chunk] for start in starts]
+    if _executor is not None and len(chunks) > 1:
+        digests = list(_executor.map(__chunk_digest, chunks))
+    else:
+        digests = [__chunk_digest(c) for c in chunks]
+    header = "{}{}".format("sampled" if sampled else "full", size)
+    return hashlib.sha1(header.encode("utf-8") +
+                        b"".join(digests)).digest()
+
+
+def __value_buffers(value):
+    """Returns a header and byte buffers representing a value (or None).
+
+    Buffers (bytes, arrays) are represented by themselves, builtin data
+    by its fingerprint, and other values by their pickle (with the
+    buffers of NumPy arrays out-of-band where supported).
+    """
+    kind = type(value)
+    if kind in {
+            bytes, bytearray, memoryview
+    } or (hasattr(value, "dtype") and hasattr(value, "shape")
+          and hasattr(value, "strides") and value.dtype.kind != "O"):
+        header = "{}{}{}".format(kind.__name__,
+                                 getattr(value, "dtype", ""),
+                                 getattr(value, "shape", ""))
+        try:
+            view = memoryview(value)
+            if not view.c_contiguous:
+                raise TypeError("not contiguous")
+        except (TypeError, ValueError):
+            view = memoryview(value.tobytes())
+        return header, [view.cast("B")]
+    if kind in __scalars or kind in {dict, list, tuple, set, frozenset}:
+        fingerprint = _fingerprint(value)
+        if fingerprint is not None:
+            return "builtin", [memoryview(fingerprint.encode("utf-8"))]
+    buffers = list()
+    try:
+        if pickle.HIGHEST_PROTOCOL >= 5:
+            pickled = pickle.dumps(value,
+                                   protocol=5,
+                                   buffer_callback=buffers.append)
+        else:
+            pickled = pickle.dumps(value,
+                                   protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    views = [memoryview(pickled)]
+    for buffer in buffers:
+        try:
+            views.append(buffer.raw())
+        except BufferError:
+            # not contiguous
+            views.append(memoryview(memoryview(buffer).tobytes()))
+    return "pickle" + kind.__name__, views
+
+
+def _value_fingerprint(value,
+                       _size_limit=None,
+                       _large="skip",
+                       _executor=None):
+    """Returns a fingerprint of an arbitrary value (or None).
+
+    Unlike `_fingerprint`, the fingerprint identifies the value and is
+    stable between processes, except for objects with non-deterministic
+    pickles. Values whose buffers exceed `_size_limit` bytes are skipped
+    (`_large="skip"`) or only sampled (`_large="sample"`).
+    """
+    represented = __value_buffers(value)
+    if represented is None:
+        return None
+    header, views = represented
+    size = sum([view.nbytes for view in views])
+    sample = _size_limit is not None and size > _size_limit
+    if sample and _large == "skip":
+        return None
+    digest = hashlib.sha1(header.encode("utf-8"))
+    for view in views:
+        digest.update(_buffer_digest(view, _executor, sample))
+    return digest.hexdigest()
+
+
+def _measure(fun, *args, **kwargs):
+    """Calls a function and measures the cost of the call.
+
+    Returns the value and a dict with the wall time, the CPU time of the
+    calling thread (both in seconds), and the change in traced memory
+    (bytes, None unless `tracemalloc` is tracing).
+    """
+    tracing = tracemalloc.is_tracing()
+    memory = tracemalloc.get_traced_memory()[0] if tracing else None
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    value = fun(*args, **kwargs)
+    cpu = time.thread_time() - cpu
+    wall = time.perf_counter() - wall
+    if tracing and tracemalloc.is_tracing():
+        memory = tracemalloc.get_traced_memory()[0] - memory
+    else:
+        memory = None
+    return value, dict(wall=wall, cpu=cpu, memory=memory)
+
+
+__truncated = object()
+
+
+def __detail(value):
+    """Returns a value for a difference record (scalars only)."""
+    if value is None or isinstance(
+            value, (bool, int, float, complex, str, bytes)):
+        return value
+    return "<{}>".format(type(value).__name__)
+
+
+def __record(kind, path, _x, _y, observed=None, expected=None, **extra):
+    """Returns a difference record."""
+    record = dict(kind=kind,
+                  path=path,
+                  x=_x,
+                  y=_y,
+                  observed=observed,
+                  expected=expected)
+    record.update(extra)
+    return record
+
+
+def __equal(x, y, _tolerance=None):
+    """Indicates whether two values are known to be equal.
+
+    Values that cannot be compared with `==` (e.g. arrays) are not known
+    to be equal. Numbers are compared with the tolerance (a dict with
+    `rtol` and `atol`) if one is given.
+    """
+    if x is y:
+        return True
+    if _tolerance is not None and isinstance(
+            x, (int, float, complex)) and isinstance(
+                y, (int, float, complex)) and not isinstance(
+                    x, bool) and not isinstance(y, bool):
+        if x != x and y != y:
+            return True
+        return cmath.isclose(x,
+                             y,
+                             rel_tol=_tolerance.get("rtol", 0.0),
+                             abs_tol=_tolerance.get("atol", 0.0))
+    try:
+        return bool(x == y)
+    except (ValueError, TypeError):
+        return False
+
+
+def __array_diff(x, y, path, _x, _y, _limit=10, _tolerance=None):
+    """Compares two array-like values with vectorized operations.
+
+    Returns a single difference record (or None) summarizing the number
+    of differing elements, the maximum absolute error and the indices of
+    the first `_limit` differences. NaN values in the same positions are
+    considered equal.
+    """
+    import numpy
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    if x.shape != y.shape:
+        return __record("shape", path, _x, _y, list(x.shape),
+                        list(y.shape))
+    if x.dtype != y.dtype:
+        return __record("dtype", path, _x, _y, x.dtype.str, y.dtype.str)
+    numeric = x.dtype.kind in "iufc"
+    if numeric and _tolerance is not None:
+        differ = ~numpy.isclose(x,
+                                y,
+                                rtol=_tolerance.get("rtol", 0.0),
+                                atol=_tolerance.get("atol", 0.0),
+                                equal_nan=True)
+    else:
+        differ = numpy.asarray(x != y, dtype=bool)
+        if x.dtype.kind in "fc":
+            differ &= ~(numpy.isnan(x) & numpy.isnan(y))
+    count = int(numpy.count_nonzero(differ))
+    if count == 0:
+        return None
+    error = None
+    if numeric:
+        errors = numpy.abs(x[differ].astype(
+            numpy.complex128 if x.dtype.kind == "c" else numpy.float64) -
+                           y[differ])
+        error = float(numpy.max(errors)) if not numpy.all(
+            numpy.isnan(errors)) else float("nan")
+    indices = [[int(i) for i in index]
+               for index in numpy.argwhere(differ)[:_limit]]
+    return __record("array",
+                    path,
+                    _x,
+                    _y,
+                    count,
+                    int(x.size),
+                    max_error=error,
+                    indices=indices)
+
+
+def _diff(x,
+          y,
+          _x="observed",
+          _y="expected",
+          _prefix="",
+          _limit=10,
+          _budget=None,
+          _tolerance=None):
+    """Returns the differences between two values as structured records.
+
+    The values are walked iteratively. Each record is a dict with the
+    `kind` of difference ("none", "class", "extra", "length", "value", or
+    "truncated"), the `path` (dot-separated fields, sequence elements in
+    brackets), the names `x` and `y` of the two values (see
+    `__deep_compare`), and scalar `observed` and `expected` details.
+    Sequences are compared element by element and at most `_limit`
+    differing elements are reported for each. The walk stops once there
+    are `_budget` records. Messages are formatted by `printers._message`.
+
+    Array-like values (NumPy, pandas) are compared with vectorized
+    operations and summarized in a single "array" record (or "shape" or
+    "dtype" records). Numbers are compared using the `_tolerance` (a dict
+    with `rtol` and `atol`) if one is given.
+    """
+    records = list()
+    if __equal(x, y, _tolerance):
+        return records
+    if y is None and ("reference" == _y or "initial" == _x):
+        return records
+    stack = [(x, y, _prefix)]
+    while len(stack) > 0 and (_budget is None or len(records) < _budget):
+        x, y, path = stack.pop()
+        if x is __truncated:
+            records.append(__record("truncated", path, _x, _y))
+            continue
+        if __equal(x, y, _tolerance):
+            continue
+        if x is None or y is None:
+            records.append(
+                __record("none", path, _x, _y, __detail(x),
+                         __detail(y)))
+            continue
+        if type(x) != type(y):
+            records.append(
+                __record("class", path, _x, _y,
+                         type(x).__name__,
+                         type(y).__name__))
+            continue
+        children = list()
+        if __is_array(x) and __is_array(y):
+            record = __array_diff(x, y, path, _x, _y, _limit,
+                                  _tolerance)
+            if record is not None:
+                records.append(record)
+            continue
+        if isinstance(x, dict):
+            x_only = [str(k) for k in x.keys() if k not in y]
+            y_only = [str(k) for k in y.keys() if k not in x]
+            if len(x_only) > 0:
+                records.append(__record("extra", path, _x, _y, x_only))
+            if len(y_only) > 0:
+                records.append(
+                    __record("extra", path, _x, _y, expected=y_only))
+            children = [(x[k], y[k], "{}.{}".format(path, k))
+                        for k in x.keys() if k in y]
+        elif isinstance(x, (list, tuple)):
+            if len(x) != len(y):
+                records.append(
+                    __record("length", path, _x, _y, len(x), len(y)))
+            for i in range(0, min(len(x), len(y))):
+                if __equal(x[i], y[i], _tolerance):
+                    continue
+                if len(children) >= _limit:
+                    # reported after the elements
+                    stack.append((__truncated, None, path))
+                    break
+                children.append((x[i], y[i], "{}[{}]".format(path, i)))
+        else:
+            records.append(
+                __record("value", path, _x, _y, __detail(x),
+                         __detail(y)))
+        stack.extend(reversed(children))
+    return records if _budget is None else records[:_budget]
+
+
 def __deep_compare(x, y, _x="observed", _y="expected", _prefix=""):
     """Comparses two values including subfields.
 
@@ -6,41 +492,12 @@ def __deep_compare(x, y, _x="observed", _y="expected", _prefix=""):
     _y - the name of the second value ("reference" is used as a special label
          for the benchmark variable)
     _prefix - the field the two values belong to (dot-separated)
+
+    Returns a list of messages or None (see `_diff` for structured results).
     """
-    if x == y:
-        return None
-    if y is None and "reference" == _y and not ("." in _prefix):
-        return None
-    if y is None and "initial" == _x and not ("." in _prefix):
-        return None
-    _nnn_message = "The {} value for '{}' is None but the {} value is not."
-    if y is None and x is not None:
-        return _nnn_message.format(_y, _prefix, _x)
-    if x is None:
-        return _nnn_message.format(_x, _prefix, _y)
-    if type(x) != type(y):
-        return "Mismatching classes for {} and {} of '{}'.".format(
-            _x, _y, _prefix)
-    result = list()
-    __list_extras_message = "Elements in '{}' only contained in the {} dictionary (but not in the {}): {}"
-    if isinstance(x, dict):
-        x_only_keys = x.keys() - y.keys()
-        y_only_keys = y.keys() - x.keys()
-        shared_keys = x.keys() & y.keys()
-        if len(x_only_keys) > 0:
-            result.append(
-                __list_extras_message.format(_prefix, _x, _y,
-                                             ", ".join(x_only_keys)))
-        if len(y_only_keys) > 0:
-            result.append(
-                __list_extras_message.format(_prefix, _y, _x,
-                                             ", ".join(y_only_keys)))
-        for key in shared_keys:
-            element_results = __deep_compare(x[key], y[key], _x, _y,
-                                             _prefix + "." + key)
-            if isinstance(element_results, str):
-                element_results = [element_results]
-            if element_results is not None:
-                result.extend(element_results)
-        return [r for r in result if r is not None]
-    return "The values of '{}' differ.".format(_prefix)
+    from . import printers
+    messages = [
+        printers._message(record)
+        for record in _diff(x, y, _x=_x, _y=_y, _prefix=_prefix)
+    ]
+    return messages if len(messages) > 0 else None
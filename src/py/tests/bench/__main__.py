@@ -0,0 +1,47 @@
+"""Runs the benchmark suite.
+
+Usage: `python -m tests.bench [--boundaries N] [--modules N]
+[--globals N] [--payload N] [--repeat N] [--scaling N]` from `src/py`.
+"""
+import argparse
+
+from . import pipeline_bench
+from . import scaling_bench
+from . import startup_bench
+
+
+def main():
+    """Parses the command line arguments and runs all benchmarks."""
+    parser = argparse.ArgumentParser(prog="python -m tests.bench")
+    parser.add_argument("--boundaries", type=int, default=1000)
+    parser.add_argument("--modules", type=int, default=2000)
+    parser.add_argument("--globals", type=int, default=2000)
+    parser.add_argument("--payload", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument(
+        "--scaling",
+        type=int,
+        default=10000,
+        help="largest number of boundaries for the scaling run")
+    arguments = parser.parse_args()
+
+    pipeline_bench.run(boundaries=arguments.boundaries,
+                       modules=arguments.modules,
+                       globals=arguments.globals,
+                       payload=arguments.payload,
+                       repeat=arguments.repeat)
+    print("# startup")
+    startup_bench.run(boundaries=arguments.boundaries,
+                      repeat=min(arguments.repeat, 20))
+    print("# scaling")
+    for boundaries, latency in scaling_bench.run([
+            c for c in scaling_bench._CHECKPOINTS
+            if c <= arguments.scaling
+    ]).items():
+        print("stage=scaling boundaries={} latency={:.1f}us".format(
+            boundaries, latency * 1e6))
+    return None
+
+
+if __name__ == "__main__":
+    main()
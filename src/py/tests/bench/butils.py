@@ -0,0 +1,103 @@
+"""Helpers for the benchmarks: synthetic load, timing and reporting."""
+import sys
+import time
+import tracemalloc
+
+from .. import tutils
+
+
+def percentile(values, p):
+    """Returns the nearest-rank percentile `p` (0-100) of `values`."""
+    if len(values) == 0:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, int(round(p / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def timed_calls(fun, n, *args, memory_calls=10):
+    """Calls `fun` `n` times and returns the latencies and peak memory.
+
+    Latencies are measured without tracing. Peak memory is the largest
+    amount of memory traced by `tracemalloc` (relative to the start)
+    during up to `memory_calls` additional calls.
+    """
+    latencies = list()
+    for i in range(0, n):
+        start = time.perf_counter()
+        fun(*args)
+        latencies.append(time.perf_counter() - start)
+    if memory_calls < 1:
+        return latencies, None
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, "reset_peak"):
+        # requires Python 3.9, the peak is otherwise that of the trace
+        tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for i in range(0, min(n, memory_calls)):
+        fun(*args)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    if started:
+        tracemalloc.stop()
+    return latencies, peak
+
+
+def report(stage, latencies, peak=None, **extra):
+    """Prints a single result line for a benchmark stage."""
+    fields = [
+        "stage={:<15s}".format(stage), "n={:<6d}".format(len(latencies))
+    ]
+    for p in [50, 90, 99]:
+        fields.append("p{}={:10.1f}us".format(
+            p,
+            percentile(latencies, p) * 1e6))
+    fields.append("max={:10.1f}us".format(max(latencies or [0]) * 1e6))
+    if peak is not None:
+        fields.append("peak={:8.1f}KiB".format(peak / 1024.0))
+    fields.extend("{}={}".format(k, v) for k, v in extra.items())
+    print(" ".join(fields))
+    return None
+
+
+def load_modules(n, prefix="ZZZZbench"):
+    """Adds `n` dummy modules to `sys.modules` and returns their names."""
+    return [
+        tutils.load_dummy_module("{}{}".format(prefix, i))
+        for i in range(0, n)
+    ]
+
+
+def unload_modules(names):
+    """Removes dummy modules from `sys.modules`."""
+    for name in names:
+        sys.modules.pop(name, None)
+    return None
+
+
+def set_globals(n, prefix="bench_global_"):
+    """Defines `n` variables in `__main__` and returns their names."""
+    main = sys.modules["__main__"]
+    names = ["{}{}".format(prefix, i) for i in range(0, n)]
+    for i, name in enumerate(names):
+        setattr(main, name, i)
+    return names
+
+
+def unset_globals(names):
+    """Removes variables from `__main__`."""
+    main = sys.modules["__main__"]
+    for name in names:
+        if hasattr(main, name):
+            delattr(main, name)
+    return None
+
+
+def payload(n):
+    """Returns a nested custom collector payload with about `n` values."""
+    width = max(1, int(n**0.5))
+    return {
+        "group{}".format(i): list(range(i, i + width))
+        for i in range(0, max(1, n // width))
+    }
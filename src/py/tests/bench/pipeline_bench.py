@@ -0,0 +1,100 @@
+"""Latency and memory of the boundary pipeline under synthetic load.
+
+Run with `python -m tests.bench` (or `make bench`) from `src/py`.
+The stages measured are: passing a boundary, copying the state with
+`get_state()`, saving and loading the lock file, and the deep
+comparison of large values with and without fingerprints.
+"""
+import copy
+import os
+import tempfile
+
+from rprdcbl import pass_initial_boundary, pass_boundary
+from rprdcbl import pass_final_boundary, get_state
+from rprdcbl import processing
+from rprdcbl.processing import _reset_all_for_testing_only
+from rprdcbl.testers import _deep_equality_test
+from rprdcbl.util import _fingerprint
+
+from . import butils
+
+
+def bench_boundaries(boundaries, custom):
+    """Passes `boundaries` boundaries and returns the lock file name."""
+    lock_file = tempfile.mktemp()
+    _reset_all_for_testing_only()
+    pass_initial_boundary(lock_file=lock_file,
+                          custom_collect=lambda: custom)
+    latencies, peak = butils.timed_calls(pass_boundary, boundaries)
+    butils.report("boundary", latencies, peak)
+
+    latencies, peak = butils.timed_calls(get_state, 5)
+    butils.report("get_state", latencies, peak)
+    latencies, peak = butils.timed_calls(lambda: get_state(view=True),
+                                         5)
+    butils.report("get_state_view", latencies, peak)
+    latencies, peak = butils.timed_calls(
+        lambda: get_state(results_only=True), 5)
+    butils.report("get_results", latencies, peak)
+
+    pass_final_boundary(quiet=True)
+    latencies = list()
+    for i in range(0, 5):
+        os.remove(lock_file)
+        latencies.extend(
+            butils.timed_calls(processing._save_lock_file,
+                               1,
+                               memory_calls=0)[0])
+    butils.report("lock_save",
+                  latencies,
+                  size="{}KiB".format(
+                      os.path.getsize(lock_file) // 1024))
+    latencies, peak = butils.timed_calls(processing._load_lock_file, 5)
+    butils.report("lock_load", latencies, peak)
+    _reset_all_for_testing_only()
+    os.remove(lock_file)
+    return None
+
+
+def bench_compare(value, repeat):
+    """Compares a large value to an equal and to a different copy."""
+    equal = copy.deepcopy(value)
+    different = copy.deepcopy(value)
+    different["changed"] = True
+    for name, other in [("compare_eq", equal),
+                        ("compare_ne", different)]:
+        latencies, peak = butils.timed_calls(_deep_equality_test,
+                                             repeat, value, other,
+                                             other)
+        butils.report(name, latencies, peak)
+    fingerprints = (_fingerprint(value), _fingerprint(equal),
+                    _fingerprint(equal))
+    latencies, peak = butils.timed_calls(
+        lambda: _deep_equality_test(
+            value, equal, equal, _fingerprints=fingerprints), repeat)
+    butils.report("compare_fp", latencies, peak)
+    latencies, peak = butils.timed_calls(_fingerprint, repeat, value)
+    butils.report("fingerprint", latencies, peak)
+    return None
+
+
+def run(boundaries=1000,
+        modules=2000,
+        globals=2000,
+        payload=10000,
+        repeat=100):
+    """Runs all pipeline benchmarks with the given synthetic load."""
+    print("# boundaries={} modules={} globals={} payload={}".format(
+        boundaries, modules, globals, payload))
+    module_names = butils.load_modules(modules)
+    global_names = butils.set_globals(globals)
+    custom = butils.payload(payload)
+    try:
+        bench_boundaries(boundaries, custom)
+        bench_compare(
+            dict(modules=processing.collectors._collect_modules(),
+                 custom=custom), repeat)
+    finally:
+        butils.unset_globals(global_names)
+        butils.unload_modules(module_names)
+    return None
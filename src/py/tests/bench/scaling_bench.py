@@ -0,0 +1,52 @@
+"""Per-boundary latency as the number of boundaries grows.
+
+Run with `python -m tests.bench.scaling_bench` from `src/py`. Only cheap
+collectors are enabled so that the bookkeeping cost of the boundary
+pipeline dominates the measurement.
+"""
+import sys
+import time
+
+from rprdcbl import pass_initial_boundary, pass_boundary
+from rprdcbl import configuration
+from rprdcbl.processing import _reset_all_for_testing_only
+
+_CHECKPOINTS = [10, 100, 1000, 10000, 100000]
+_WINDOW = 10
+_COLLECTORS = ["environment", "variant", "version", "locale", "custom"]
+
+
+def _restrict_collectors(names):
+    collectors = configuration._cget("collectors")
+    testers = configuration._cget("testers")
+    configuration._cset("collectors", {k: collectors[k] for k in names})
+    configuration._cset("testers", {k: testers[k] for k in names})
+    return None
+
+
+def run(checkpoints=_CHECKPOINTS, window=_WINDOW):
+    """Returns the mean latency (seconds) around each checkpoint."""
+    _reset_all_for_testing_only()
+    pass_initial_boundary(custom_collect=lambda: dict(value=0))
+    _restrict_collectors(_COLLECTORS)
+    results = dict()
+    n = 1
+    for checkpoint in checkpoints:
+        while n < checkpoint - window:
+            pass_boundary()
+            n += 1
+        start = time.perf_counter()
+        for i in range(0, window):
+            pass_boundary()
+        results[checkpoint] = (time.perf_counter() - start) / window
+        n += window
+    _reset_all_for_testing_only()
+    return results
+
+
+if __name__ == "__main__":
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else max(_CHECKPOINTS)
+    for boundaries, latency in run(
+        [c for c in _CHECKPOINTS if c <= limit]).items():
+        print("boundaries={:>7d} latency={:10.2f}us".format(
+            boundaries, latency * 1e6))
@@ -0,0 +1,43 @@
+"""Import time and the cost of boundaries with tracking disabled.
+
+Run with `python -m tests.bench.startup_bench` from `src/py`. The import
+time is the cumulative time reported by `python -X importtime` for a
+fresh interpreter.
+"""
+import os
+import subprocess
+import sys
+
+from rprdcbl import pass_initial_boundary, pass_boundary
+from rprdcbl import new_session, use_session
+
+from . import butils
+
+
+def import_time():
+    """Returns the time (seconds) taken by `import rprdcbl`."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import rprdcbl"],
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+        capture_output=True,
+        text=True,
+        check=True).stderr
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "rprdcbl":
+            return int(fields[1]) / 1e6
+    raise Exception("The import time was not reported.")
+
+
+def run(boundaries=1000, repeat=100):
+    """Reports the import time and the latency of disabled boundaries."""
+    butils.report("import", [import_time() for i in range(0, repeat)])
+    with use_session(new_session()):
+        pass_initial_boundary(disable=True)
+        latencies, peak = butils.timed_calls(pass_boundary, boundaries)
+    butils.report("disabled", latencies, peak)
+    return None
+
+
+if __name__ == "__main__":
+    run()
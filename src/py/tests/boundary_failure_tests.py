@@ -1,6 +1,7 @@
 import unittest
-from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing
+from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing, get_state
 from rprdcbl.processing import _reset_all_for_testing_only
+from rprdcbl.printers import _message
 from . import tutils
 
 
@@ -30,3 +31,23 @@ class BoundaryTests(unittest.TestCase):
         tutils.load_dummy_module("ZZZZsingleFailureWithParsable")
         pass_final_boundary()
         self.assertTrue(is_failing())
+
+    def testIncrementalModuleTracking(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary(fail='never',
+                              module_tracking='incremental')
+        pass_boundary()
+        tutils.load_dummy_module("ZZZZincrementalModuleTracking")
+        pass_final_boundary(quiet=True)
+        self.assertTrue(is_failing())
+        boundaries = get_state()["boundaries"]
+        self.assertIs(boundaries[0]["data"]["modules"],
+                      boundaries[1]["data"]["modules"])
+        self.assertIn("ZZZZincrementalModuleTracking",
+                      boundaries[2]["data"]["modules"])
+        self.assertEqual(
+            [_message(r) for r in boundaries[2]["results"]], [
+                "Elements in 'modules' only contained in the default " +
+                "dictionary (but not in the previous): " +
+                "ZZZZincrementalModuleTracking"
+            ])
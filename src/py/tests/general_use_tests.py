@@ -1,8 +1,19 @@
 import unittest
+import json
+import logging
+import logging.handlers
+import os
+import tempfile
 import re
+import subprocess
+import sys
+import threading
+import time
 
-from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing, get_state
+from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing, get_state, get_profile
+from rprdcbl import new_session, use_session, close_session, pass_sampled_boundary
 from rprdcbl.processing import _reset_all_for_testing_only
+from rprdcbl import processing
 from . import tutils
 
 
@@ -36,3 +47,356 @@ class GeneralTests(unittest.TestCase):
         self.assertTrue(
             re.match(".*\\(True, True, None\\).*",
                      get_state()["boundaries"][1]["results"][0]))
+
+    def testStreamingReports(self):
+        report_file = tempfile.mktemp()
+        self.addCleanup(os.remove, report_file)
+        lines = list()
+        logger = logging.getLogger("rprdcbl.tests")
+        handler = logging.handlers.BufferingHandler(100)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        for report_to in [
+                report_file, logger,
+                lambda line, level: lines.append(line)
+        ]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(
+                custom_collect=lambda: [1, 2, 3],
+                custom_test=lambda l, p, r: "Changed.",
+                output_mode="jsonl",
+                report_to=report_to)
+            pass_final_boundary()
+        self.assertEqual([record.levelno for record in handler.buffer],
+                         [logging.WARNING] * 2)
+        with open(report_file, "r") as fh:
+            self.assertEqual(fh.read().splitlines(), lines)
+        items = [json.loads(line) for line in lines]
+        self.assertEqual([item["boundary"] for item in items], [1, 2])
+        self.assertEqual(items[1]["message"], "Changed.")
+        self.assertEqual(items[1]["label"], "FINAL")
+        _reset_all_for_testing_only()
+        with self.assertRaisesRegex(Exception, ".*report target.*"):
+            pass_initial_boundary(report_to=1)
+
+    def testConcurrentSessions(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary()
+        counts = dict()
+
+        def run_in(session, fun, *args):
+            with use_session(session):
+                fun(*args)
+            return None
+
+        def run(n):
+            session = new_session()
+            with use_session(session):
+                pass_initial_boundary(custom_collect=lambda: n)
+                # threads start in the default session
+                threads = [
+                    threading.Thread(target=run_in,
+                                     args=(session, pass_boundary))
+                    for i in range(0, n)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                pass_final_boundary(quiet=True)
+                boundaries = get_state()["boundaries"]
+                counts[n] = (len(boundaries),
+                             boundaries[0]["data"]["custom"])
+            return None
+
+        runs = [
+            threading.Thread(target=run, args=(n, )) for n in [3, 7]
+        ]
+        for thread in runs:
+            thread.start()
+        for thread in runs:
+            thread.join()
+        self.assertEqual(counts, {3: (5, 3), 7: (9, 7)})
+        # the default session is not affected
+        self.assertEqual(len(get_state()["boundaries"]), 1)
+        with self.assertRaises(Exception):
+            use_session("session")
+
+    def testIncrementalFailureIndex(self):
+        _reset_all_for_testing_only()
+        counter = dict(n=0)
+
+        def collect():
+            counter["n"] += 1
+            return counter["n"]
+
+        pass_initial_boundary(custom_collect=collect,
+                              custom_test=lambda l, p, r: "odd"
+                              if l % 2 == 1 else None)
+        self.assertTrue(is_failing())
+        pass_boundary()
+        pass_boundary()
+        pass_final_boundary(quiet=True)
+        state = get_state()
+        self.assertEqual(state["failures"], [1, 3])
+        self.assertEqual(
+            [len(b["results"]) for b in state["boundaries"]],
+            [1, 0, 1, 0])
+
+    def testFailingFinalBoundary(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        lock_file = os.path.join(directory, "missing", "lock")
+        finders = list(sys.meta_path)
+        for module_tracking in ["full", "incremental"]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=lock_file,
+                                  module_tracking=module_tracking,
+                                  collect_mode="thread")
+            # one finder records the imports
+            self.assertEqual(len(sys.meta_path), len(finders) + 1)
+            with self.assertRaises(Exception):
+                pass_final_boundary(quiet=True)
+            # the session is finalized nonetheless
+            self.assertEqual(sys.meta_path, finders)
+            with self.assertRaisesRegex(Exception, "Final boundary.*"):
+                pass_boundary()
+
+    def testFailingSession(self):
+        _reset_all_for_testing_only()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        finders = list(sys.meta_path)
+        threads = set(threading.enumerate())
+        sessions = [new_session(), new_session()]
+        for n, session in enumerate(sessions):
+            journal = os.path.join(directory, "journal{}".format(n))
+            report = os.path.join(directory, "report{}".format(n))
+            self.addCleanup(os.remove, journal)
+            self.addCleanup(os.remove, report)
+            with self.assertRaisesRegex(Exception, "failed"):
+                with use_session(session):
+                    pass_initial_boundary(collect_mode="thread",
+                                          journal=journal,
+                                          report_to=report)
+                    pass_boundary()
+                    if n == 0:
+                        raise Exception("failed")
+                    close_session()
+                    self.assertIsNone(session["data"]["journal"])
+                    raise Exception("failed")
+        # nothing is left behind
+        self.assertEqual(sys.meta_path, finders)
+        for thread in set(threading.enumerate()) - threads:
+            thread.join(1.0)
+            self.assertFalse(thread.is_alive())
+        for session in sessions:
+            self.assertIsNone(session["data"]["journal"])
+            with use_session(session):
+                self.assertEqual(len(get_state()["boundaries"]), 2)
+                with self.assertRaisesRegex(Exception,
+                                            "Final boundary.*"):
+                    pass_boundary()
+            close_session(session)
+
+    def testCollectorTimeout(self):
+        _reset_all_for_testing_only()
+        release = threading.Event()
+        calls = list()
+
+        def collect():
+            calls.append(len(calls))
+            return release.wait(5)
+
+        pass_initial_boundary(custom_collect=collect,
+                              collect_mode="thread",
+                              collect_timeout=0.1)
+        pass_boundary()
+        # a collector that is still running is not called again
+        self.assertEqual(calls, [0])
+        release.set()
+        processing._data["running"]["custom"].result()
+        pass_final_boundary(quiet=True)
+        self.assertEqual(calls, [0, 1])
+        self.assertTrue(is_failing())
+        self.assertEqual(get_state()["boundaries"][0]["results"], [
+            "The collector 'custom' did not finish within 0.1 seconds."
+        ])
+        self.assertEqual(get_state()["failures"], [1, 2])
+        # the interpreter does not wait for a stuck collector
+        for collect_mode in ["thread", "process"]:
+            script = (
+                "import functools, time, rprdcbl; " +
+                "rprdcbl.pass_initial_boundary(custom_collect=" +
+                "functools.partial(time.sleep, 30), " +
+                "collect_mode='{}', collect_timeout=0.1); " +
+                "rprdcbl.pass_final_boundary()").format(collect_mode)
+            start = time.monotonic()
+            subprocess.run([sys.executable, "-c", script],
+                           cwd=os.path.dirname(
+                               os.path.dirname(__file__)),
+                           capture_output=True,
+                           check=True,
+                           timeout=20)
+            self.assertLess(time.monotonic() - start, 10)
+
+    def testProcessCollectionRequiresPicklable(self):
+        _reset_all_for_testing_only()
+        with self.assertRaisesRegex(Exception, ".*picklable.*"):
+            pass_initial_boundary(custom_collect=lambda: 1,
+                                  collect_mode="process")
+
+    def testProcessCollection(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary(custom_collect=os.getpid,
+                              collect_mode="process")
+        pass_final_boundary(quiet=True)
+        self.assertFalse(is_failing())
+        self.assertNotEqual(
+            get_state()["boundaries"][0]["data"]["custom"], os.getpid())
+
+    def testCollectorCaching(self):
+        _reset_all_for_testing_only()
+        calls = dict(collect=0, test=0, key=0)
+
+        def collect():
+            calls["collect"] += 1
+            return calls["key"]
+
+        def test(l, p, r):
+            calls["test"] += 1
+            return None
+
+        pass_initial_boundary(custom_collect=collect,
+                              custom_test=test,
+                              custom_collect_key=lambda: calls["key"])
+        pass_boundary()
+        pass_boundary()
+        self.assertEqual((calls["collect"], calls["test"]), (1, 1))
+        calls["key"] = 1
+        pass_final_boundary(quiet=True)
+        self.assertEqual((calls["collect"], calls["test"]), (2, 2))
+        self.assertFalse(is_failing())
+        boundaries = get_state()["boundaries"]
+        self.assertEqual([b["data"]["custom"] for b in boundaries],
+                         [0, 0, 0, 1])
+        self.assertEqual(boundaries[3]["data"]["os"],
+                         boundaries[0]["data"]["os"])
+        _reset_all_for_testing_only()
+        with self.assertRaisesRegex(Exception, ".*collector key.*"):
+            pass_initial_boundary(custom_collect_key="dynamic")
+
+    def testDisabledMode(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary(disable=True, lock_file="/nonexistent/x")
+        start = time.perf_counter()
+        for i in range(10000):
+            pass_boundary()
+            pass_sampled_boundary()
+        self.assertLess(time.perf_counter() - start, 0.1)
+        pass_final_boundary()
+        self.assertIsNone(get_state())
+        self.assertFalse(is_failing(wait=True))
+        # the processing modules are not even imported
+        script = ("import sys, rprdcbl; " +
+                  "rprdcbl.pass_initial_boundary(); " +
+                  "rprdcbl.pass_final_boundary(); " +
+                  "print(sorted(m for m in sys.modules " +
+                  "if m.startswith('rprdcbl')))")
+        output = subprocess.run([sys.executable, "-c", script],
+                                cwd=os.path.dirname(
+                                    os.path.dirname(__file__)),
+                                env=dict(os.environ,
+                                         RPRDCBL_DISABLE="1"),
+                                capture_output=True,
+                                text=True,
+                                check=True).stdout
+        self.assertEqual(output.strip(),
+                         "['rprdcbl', 'rprdcbl.configuration']")
+
+    def testAsynchronousBoundaries(self):
+        _reset_all_for_testing_only()
+
+        def slow_test(l, p, r):
+            time.sleep(0.2)
+            return None
+
+        pass_initial_boundary(asynchronous=True, custom_test=slow_test)
+        start = time.perf_counter()
+        pass_boundary()
+        pass_boundary()
+        self.assertLess(time.perf_counter() - start, 0.2)
+        pass_final_boundary(quiet=True)
+        self.assertFalse(is_failing())
+        self.assertEqual(
+            [b["results"] for b in get_state()["boundaries"]],
+            [[], [], [], []])
+
+    def testAsynchronousEarlyFailure(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary(
+            asynchronous=True,
+            fail="early",
+            custom_collect=lambda: len(get_state()["boundaries"]),
+            custom_test=lambda l, p, r: "late" if l > 0 else None)
+        pass_boundary()
+        self.assertTrue(is_failing(wait=True))
+        with self.assertRaisesRegex(Exception, ".*reproducibility.*"):
+            pass_boundary()
+
+    def testProfiling(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary()
+        pass_final_boundary(quiet=True)
+        self.assertEqual(get_profile(), [])
+
+        _reset_all_for_testing_only()
+        pass_initial_boundary(profile="memory")
+        pass_final_boundary(quiet=True)
+        profile = get_profile()
+        self.assertEqual(len(profile), 2)
+        self.assertIn("modules", profile[0]["collectors"])
+        self.assertIn("custom", profile[0]["testers"])
+        self.assertIn("save", profile[1]["stages"])
+        self.assertIsNotNone(
+            profile[0]["collectors"]["modules"]["memory"])
+        self.assertGreaterEqual(
+            profile[0]["stages"]["collect"]["wall"],
+            profile[0]["collectors"]["modules"]["wall"])
+
+    def testSelectiveState(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary(custom_collect=lambda: dict(a=[1, 2]))
+        pass_boundary()
+        pass_final_boundary(quiet=True)
+        state = get_state(boundaries=range(2, 10),
+                          collectors=["custom"])
+        self.assertEqual([b["number"] for b in state["boundaries"]],
+                         [2, 3])
+        self.assertEqual(list(state["boundaries"][0]["data"].keys()),
+                         ["custom"])
+        state = get_state(results_only=True)
+        self.assertEqual(len(state["boundaries"]), 3)
+        self.assertNotIn("data", state["boundaries"][0])
+        self.assertEqual(state["boundaries"][0]["results"], [])
+
+    def testStateView(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary(custom_collect=lambda: dict(a=[1, 2]))
+        pass_final_boundary(quiet=True)
+        view = get_state(view=True)
+        copied = get_state()
+        # both return the same parts of the state
+        self.assertEqual(set(view.keys()), set(copied.keys()))
+        boundary = view["boundaries"][1]
+        self.assertEqual(boundary["data"]["custom"]["a"], (1, 2))
+        self.assertEqual(dict(boundary["data"]["version"]),
+                         copied["boundaries"][1]["data"]["version"])
+        with self.assertRaises(TypeError):
+            boundary["data"]["custom"]["a"] = None
+        with self.assertRaises(TypeError):
+            boundary["label"] = None
+        # shared values have a single shared view
+        self.assertIs(
+            view["boundaries"][0]["data"]["modules"],
+            get_state(view=True)["boundaries"][1]["data"]["modules"])
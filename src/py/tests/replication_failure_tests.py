@@ -1,11 +1,38 @@
 import unittest
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import json
+import sys
+import importlib.util
 import tempfile
+import random
 import os
-from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing
+import pickle
+import shutil
+import sqlite3
+import time
+import warnings
+from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing, get_state, register_prng
+from rprdcbl import pass_sampled_boundary
+from rprdcbl import get_worker_configuration, start_worker, finish_worker, merge_worker
 from rprdcbl.processing import _reset_all_for_testing_only
+from rprdcbl import processing
+from rprdcbl.storage import _encode, _decode, _open_indexed
+from rprdcbl.util import _value_fingerprint
+from rprdcbl.__main__ import main as compare_main
 from . import tutils
 
 
+def tracked_task(configuration, n, seed):
+    random.seed(seed)
+    start_worker(configuration, "task{}".format(n))
+    random.random()
+    pass_boundary()
+    return finish_worker()
+
+
 class ReplicationTests(unittest.TestCase):
 
     def setUp(self):
@@ -45,3 +72,491 @@ class ReplicationTests(unittest.TestCase):
         pass_final_boundary()
         self.assertTrue(is_failing())
         self.assertTrue(os.path.exists(self.lock_file_name))
+
+    def testSharedSnapshots(self):
+        sizes = list()
+        for boundaries in [1, 100]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=self.lock_file_name)
+            for i in range(0, boundaries):
+                pass_boundary()
+            pass_final_boundary(quiet=True)
+            sizes.append(os.path.getsize(self.lock_file_name))
+            os.remove(self.lock_file_name)
+        state = get_state()["boundaries"]
+        self.assertIs(state[0]["data"]["version"],
+                      state[-1]["data"]["version"])
+        self.assertIs(state[0]["data"]["modules"],
+                      state[-1]["data"]["modules"])
+        # unchanged values are stored once, not once per boundary
+        self.assertLess(sizes[1], 5 * sizes[0])
+
+    def testJournalResume(self):
+        journal = self.lock_file_name + ".journal"
+        self.addCleanup(os.remove, journal)
+        counter = [0]
+        options = dict(lock_file=self.lock_file_name,
+                       custom_collect=lambda: list(range(counter[0])),
+                       journal=journal,
+                       keep_data=False)
+        # an interrupted run: the last record is incomplete
+        _reset_all_for_testing_only()
+        pass_initial_boundary(**options)
+        for i in range(0, 3):
+            counter[0] += 1
+            pass_boundary()
+        state = get_state()["boundaries"]
+        self.assertNotIn("data", state[0])
+        self.assertIn("data", state[-1])
+        _reset_all_for_testing_only()
+        with open(journal, "ab") as fh:
+            fh.write(b"\x10\x00\x00")
+        # the resumed run continues after the journaled boundaries
+        pass_initial_boundary(resume=True, **options)
+        self.assertEqual(len(get_state()["boundaries"]), 4)
+        counter[0] += 1
+        pass_final_boundary(quiet=True)
+        self.assertFalse(is_failing())
+        self.assertTrue(os.path.exists(self.lock_file_name))
+        # a completed run is resumed as finalized (and saves its lock file)
+        os.remove(self.lock_file_name)
+        _reset_all_for_testing_only()
+        finders = list(sys.meta_path)
+        pass_initial_boundary(resume=True, **options)
+        self.assertEqual(len(get_state()["boundaries"]), 5)
+        self.assertFalse(is_failing())
+        self.assertTrue(os.path.exists(self.lock_file_name))
+        self.assertEqual(sys.meta_path, finders)
+        with self.assertRaisesRegex(Exception, "Final boundary.*"):
+            pass_boundary()
+        # an uninterrupted run matches the resumed one
+        _reset_all_for_testing_only()
+        counter[0] = 0
+        pass_initial_boundary(**options)
+        for i in range(0, 4):
+            counter[0] += 1
+            if i < 3:
+                pass_boundary()
+        pass_final_boundary(quiet=True)
+        self.assertFalse(is_failing())
+        reference = get_state()["reference"]
+        self.assertEqual(len(reference), 5)
+        self.assertEqual(reference[-1]["data"]["custom"], [0, 1, 2, 3])
+
+    def testValuesChangedInPlace(self):
+        value = dict(x=1.0)
+        for x, failing in [(1.0, False), (2.0, True)]:
+            _reset_all_for_testing_only()
+            value["x"] = 1.0
+            pass_initial_boundary(
+                lock_file=self.lock_file_name,
+                custom_collect=lambda: value,
+                tolerances=dict(custom=dict(atol=1e-9)))
+            value["x"] = x
+            pass_boundary()
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+        boundaries = get_state()["boundaries"]
+        self.assertNotEqual(boundaries[0]["fingerprints"]["custom"],
+                            boundaries[1]["fingerprints"]["custom"])
+
+    def testLockFileFormats(self):
+        value = dict(a=[1, (2.5, None)], b={1: b"x", (2, 3): {"y"}})
+        self.assertEqual(_decode(json.dumps(_encode(value))), value)
+        for lock_format in ["pickle", "indexed"]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=self.lock_file_name,
+                                  lock_format=lock_format,
+                                  custom_collect=lambda: value)
+            pass_final_boundary(quiet=True)
+            # both formats are read, pickles with a warning
+            _reset_all_for_testing_only()
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                pass_initial_boundary(lock_file=self.lock_file_name,
+                                      custom_collect=lambda: value)
+            self.assertEqual(
+                [str(w.message) for w in caught],
+                [] if lock_format == "indexed" else [
+                    "The lock file `{}` is read in the pickle format, "
+                    "which is only safe for trusted files.".format(
+                        self.lock_file_name)
+                ])
+            pass_final_boundary(quiet=True)
+            self.assertFalse(is_failing())
+            reference = get_state(collectors=["custom"])["reference"]
+            self.assertEqual(reference[0]["data"], dict(custom=value))
+            self.assertEqual(
+                get_state(results_only=True)["reference"][0]["results"],
+                [])
+            os.remove(self.lock_file_name)
+        # the indexed format is decoded lazily
+        self.assertNotIn("data", processing._data["reference"][0])
+        # decoded values are cached, and so are their views
+        self.assertIs(
+            get_state(view=True)["reference"][0]["data"]["custom"],
+            get_state(view=True)["reference"][0]["data"]["custom"])
+        # other values are saved in the pickle format instead
+        date = datetime.date(2020, 1, 1)
+        _reset_all_for_testing_only()
+        pass_initial_boundary(lock_file=self.lock_file_name,
+                              custom_collect=lambda: date)
+        with self.assertWarnsRegex(UserWarning,
+                                   ".*pickle format instead.*"):
+            pass_final_boundary(quiet=True)
+        _reset_all_for_testing_only()
+        with self.assertWarnsRegex(UserWarning, ".*pickle format.*"):
+            pass_initial_boundary(lock_file=self.lock_file_name,
+                                  custom_collect=lambda: date)
+        pass_final_boundary(quiet=True)
+        self.assertFalse(is_failing())
+        self.assertIsNone(_open_indexed(self.lock_file_name))
+        self.assertEqual(get_state()["reference"][0]["data"]["custom"],
+                         date)
+
+    def testGlobalValues(self):
+        main = sys.modules["__main__"]
+        self.addCleanup(delattr, main, "rprdcbl_test_value")
+        for value, failing in [(bytearray(3), False),
+                               (bytearray(3), False),
+                               (bytearray(b"abc"), True)]:
+            main.rprdcbl_test_value = value
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=self.lock_file_name,
+                                  global_tracking="values")
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+        data = get_state()["boundaries"][0]["data"]
+        self.assertIn("rprdcbl_test_value", data["global_values"])
+
+    def testValueFingerprints(self):
+        value = bytearray(range(256)) * 40000
+        fingerprint = _value_fingerprint(value)
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            self.assertEqual(
+                _value_fingerprint(value, _executor=executor),
+                fingerprint)
+        self.assertIsNone(_value_fingerprint(value, _size_limit=1024))
+        sampled = _value_fingerprint(value,
+                                     _size_limit=1024,
+                                     _large="sample")
+        self.assertNotEqual(sampled, fingerprint)
+        value[len(value) // 2] += 1
+        self.assertNotEqual(_value_fingerprint(value), fingerprint)
+        # other objects are pickled
+        self.assertEqual(_value_fingerprint(random.Random(1)),
+                         _value_fingerprint(random.Random(1)))
+        self.assertEqual(_value_fingerprint({"b", "a"}),
+                         _value_fingerprint({"a", "b"}))
+        self.assertIsNone(_value_fingerprint(lambda: None))
+
+    def testSampledBoundaries(self):
+        for seed, failing in [(1, False), (1, False), (2, True)]:
+            _reset_all_for_testing_only()
+            random.seed(seed)
+            pass_initial_boundary(lock_file=self.lock_file_name,
+                                  sample_mode="every",
+                                  sample_rate=3)
+            for i in range(10):
+                random.random()
+                pass_sampled_boundary("loop")
+            pass_boundary()
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+        boundaries = get_state()["boundaries"]
+        self.assertEqual(
+            [b.get("sample") for b in boundaries[1:5]],
+            [["loop", 0], ["loop", 3], ["loop", 6], ["loop", 9]])
+        self.assertEqual(sorted(boundaries[1]["data"].keys()),
+                         ["PRNG", "PRNG_NumPy", "custom"])
+        # full boundaries are compared to the previous full boundary
+        self.assertTrue(
+            all(result["path"].startswith("PRNG")
+                for result in boundaries[5]["results"]))
+        os.remove(self.lock_file_name)
+        # the reference determines the boundaries sampled by a replay
+        for mode, rate in [("interval", 3600), ("interval", 1e-9)]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=self.lock_file_name,
+                                  sample_mode=mode,
+                                  sample_rate=rate)
+            for i in range(5):
+                pass_sampled_boundary()
+            pass_final_boundary(quiet=True)
+            self.assertFalse(is_failing())
+            self.assertEqual(len(get_state()["boundaries"]), 3)
+        os.remove(self.lock_file_name)
+        _reset_all_for_testing_only()
+        pass_initial_boundary(sample_mode="backoff", sample_rate=2)
+        for i in range(10):
+            pass_sampled_boundary()
+        self.assertEqual(
+            [b["sample"][1] for b in get_state()["boundaries"][1:]],
+            [0, 1, 2, 4, 8])
+
+    def testLockFileComparison(self):
+        fnames = list()
+        for seed, lock_format in [(1, "indexed"), (1, "pickle"),
+                                  (2, "indexed"), (2, "pickle")]:
+            fnames.append(self.lock_file_name + str(len(fnames)))
+            self.addCleanup(os.remove, fnames[-1])
+            _reset_all_for_testing_only()
+            random.seed(seed)
+            pass_initial_boundary(lock_file=fnames[-1],
+                                  lock_format=lock_format)
+            pass_final_boundary(quiet=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertWarnsRegex(
+                UserWarning, ".*pickle format.*"):
+            status = compare_main(
+                ["--output-mode", "jsonl", "diff", "--budget", "1"] +
+                fnames[:3])
+        lines = [
+            json.loads(line) for line in output.getvalue().splitlines()
+        ]
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            {(line["file"], line["boundary"], line["path"][:4])
+             for line in lines if line["type"] == "result"},
+            {(fnames[2], 1, "PRNG"), (fnames[2], 2, "PRNG")})
+        self.assertEqual([
+            line["files"] for line in lines if line["type"] == "group"
+        ], [fnames[:2], fnames[2:3]])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertWarnsRegex(
+                UserWarning, ".*pickle format.*"):
+            status = compare_main(["matrix"] + fnames[:2])
+        self.assertEqual(status, 0)
+        self.assertEqual(output.getvalue().splitlines()[0],
+                         "M: R=\"{}\" F=\"{}\" N=0".format(*fnames[:2]))
+        # lock files of earlier versions have no fingerprints
+        for fname in fnames[1::2]:
+            with open(fname, "rb") as fh:
+                loaded_data = pickle.load(fh)
+            for boundary in loaded_data["boundaries"]:
+                boundary.pop("fingerprints")
+            with open(fname, "wb") as fh:
+                pickle.dump(loaded_data, fh)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertWarnsRegex(
+                UserWarning, ".*pickle format.*"):
+            status = compare_main(["matrix"] + fnames[1::2])
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            output.getvalue().splitlines()[0],
+            "M: R=\"{}\" F=\"{}\" N=2".format(*fnames[1::2]))
+
+    def testReferenceStore(self):
+        store = self.lock_file_name + ".store"
+        self.addCleanup(shutil.rmtree, store)
+        dummy = "ZZZZreferenceStore"
+        self.addCleanup(sys.modules.pop, dummy, None)
+        ignored = list()
+        for seed, load, failing, runs in [(1, False, False, 1),
+                                          (1, False, False, 1),
+                                          (1, True, False, 2),
+                                          (1, True, False, 2),
+                                          (2, True, True, 2)]:
+            if load:
+                tutils.load_dummy_module(dummy)
+            _reset_all_for_testing_only()
+            random.seed(seed)
+            pass_initial_boundary(reference_store=store)
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+            ignored.append(processing._data["reference_ignored"])
+            with contextlib.closing(
+                    sqlite3.connect(os.path.join(
+                        store, "index.sqlite"))) as db:
+                self.assertEqual(
+                    db.execute("SELECT COUNT(*) FROM runs").fetchone()[0],
+                    runs)
+        # the closest run of the third run differs in its modules
+        self.assertEqual(
+            ignored, [set(), set(), {"modules"},
+                      set(), set()])
+        _reset_all_for_testing_only()
+        with self.assertRaises(Exception):
+            pass_initial_boundary(reference_store=store,
+                                  lock_file=self.lock_file_name)
+
+    def testPerformanceRegression(self):
+        tolerance = dict(wall=dict(rtol=1.0, atol=0.05))
+        for duration, failing in [(0.01, False), (0.01, False),
+                                  (0.2, True)]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=self.lock_file_name,
+                                  performance="memory",
+                                  performance_tolerance=tolerance)
+            time.sleep(duration)
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+        boundaries = get_state()["boundaries"]
+        self.assertEqual(sorted(boundaries[1]["data"]["performance"]),
+                         ["cpu", "memory", "rss", "wall"])
+        self.assertEqual(
+            [result["path"] for result in boundaries[1]["results"]],
+            ["performance.wall"])
+        _reset_all_for_testing_only()
+        with self.assertRaises(Exception):
+            pass_initial_boundary(performance="time",
+                                  performance_tolerance=dict(io=dict()))
+        # lock files are compared with the default tolerances
+        fnames = list()
+        for duration in [0.0, 0.0, 0.3]:
+            fnames.append(self.lock_file_name + str(len(fnames)))
+            self.addCleanup(os.remove, fnames[-1])
+            _reset_all_for_testing_only()
+            random.seed(1)
+            pass_initial_boundary(lock_file=fnames[-1],
+                                  performance="time")
+            time.sleep(duration)
+            pass_final_boundary(quiet=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = compare_main(["--output-mode", "jsonl", "diff"] +
+                                  fnames)
+        lines = [
+            json.loads(line) for line in output.getvalue().splitlines()
+        ]
+        self.assertEqual(
+            [(line["file"], line["path"])
+             for line in lines if line["type"] == "result"],
+            [(fnames[2], "performance.wall")])
+        # the resources used do not separate groups of runs
+        self.assertEqual(status, 0)
+
+    def testInputFiles(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        data = os.path.join(directory, "data.txt")
+        with open(data, "wb") as fh:
+            fh.write(b"abc" * 2**20)
+        open(os.path.join(directory, "empty.txt"), "wb").close()
+        cache = os.path.join(directory, "cache.json")
+        missing = os.path.join(directory, "missing.csv")
+        stat = os.stat(data)
+        for content, failing in [(b"a", False), (b"b", False),
+                                 (b"c", True)]:
+            with open(data, "r+b") as fh:
+                fh.write(content)
+            if content != b"c":
+                # digests are cached by inode, size and modification time
+                os.utime(data, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            _reset_all_for_testing_only()
+            pass_initial_boundary(
+                lock_file=self.lock_file_name,
+                track_files=[os.path.join(directory, "*.txt"), missing],
+                file_cache=cache,
+                hash_threads=2)
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+        boundaries = get_state()["boundaries"]
+        self.assertEqual(
+            sorted(boundaries[0]["data"]["files"].keys()),
+            sorted(
+                [data, missing,
+                 os.path.join(directory, "empty.txt")]))
+        self.assertIsNone(boundaries[0]["data"]["files"][missing])
+        self.assertIs(boundaries[0]["data"]["files"],
+                      boundaries[1]["data"]["files"])
+        self.assertEqual(
+            {result["path"][:5]
+             for result in boundaries[0]["results"]}, {"files"})
+        with open(cache, "r") as fh:
+            self.assertEqual(len(json.load(fh)["files"]), 2)
+        # workers track the same files
+        _reset_all_for_testing_only()
+        pass_initial_boundary(track_files=[data])
+        configuration = get_worker_configuration()
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            stream = executor.submit(tracked_task, configuration, 0,
+                                     1).result()
+        self.assertEqual(list(stream["boundaries"][0]["data"]["files"]),
+                         [data])
+
+    def testWorkerProcesses(self):
+        # the modules used for the pool are loaded before the boundaries
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            executor.submit(int).result()
+        for seeds, failing in [([1, 2], False), ([1, 2], False),
+                               ([1, 3], True)]:
+            _reset_all_for_testing_only()
+            pass_initial_boundary(lock_file=self.lock_file_name)
+            configuration = get_worker_configuration()
+            with concurrent.futures.ProcessPoolExecutor(2) as executor:
+                futures = [
+                    executor.submit(tracked_task, configuration, n,
+                                    seed)
+                    for n, seed in enumerate(seeds)
+                ]
+                streams = [future.result() for future in futures]
+            for stream in streams:
+                merge_worker(stream)
+            with self.assertRaises(Exception):
+                merge_worker(streams[0])
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+        workers = get_state()["workers"]
+        self.assertEqual(sorted(workers.keys()), ["task0", "task1"])
+        self.assertEqual([b["label"] for b in workers["task1"]],
+                         ["INITIAL", "BOUNDARY2", "FINAL"])
+        self.assertEqual(workers["task0"][1]["results"], [])
+        self.assertTrue(
+            workers["task1"][1]["results"][0]["path"].startswith("PRNG"))
+        view = get_state(view=True)["workers"]
+        self.assertEqual(view["task1"][1]["results"][0]["path"],
+                         workers["task1"][1]["results"][0]["path"])
+
+    def run_with_prng(self, seed, prng):
+        generator = random.Random(seed)
+        _reset_all_for_testing_only()
+        register_prng(generator, "generator")
+        pass_initial_boundary(lock_file=self.lock_file_name, prng=prng)
+        generator.random()
+        pass_boundary()
+        pass_final_boundary(quiet=True)
+        return is_failing()
+
+    def testRegisteredPrngReplication(self):
+        for prng in ["digest", "full"]:
+            self.assertFalse(self.run_with_prng(1, prng))
+            self.assertFalse(self.run_with_prng(1, prng))
+            self.assertTrue(self.run_with_prng(2, prng))
+            # digests only report that a state differs
+            paths = {
+                result["path"]
+                for result in get_state()["boundaries"][0]["results"]
+            }
+            if prng == "digest":
+                self.assertEqual(paths,
+                                 {"PRNG_NumPy.generators.generator"})
+            else:
+                self.assertGreater(len(paths), 1)
+            os.remove(self.lock_file_name)
+
+    def testPrngDigest(self):
+        self.run_with_prng(1, "digest")
+        data = get_state()["boundaries"][0]["data"]
+        self.assertEqual(len(data["PRNG"]), 40)
+        self.assertEqual(
+            len(data["PRNG_NumPy"]["generators"]["generator"]), 40)
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"),
+                         "requires NumPy")
+    def testNumPyPrng(self):
+        import numpy
+        generator = numpy.random.default_rng(1)
+        for prng in ["digest", "full"]:
+            _reset_all_for_testing_only()
+            register_prng(generator, "numpy")
+            pass_initial_boundary(prng=prng)
+            generator.random()
+            numpy.random.random()
+            pass_final_boundary(quiet=True)
+            boundaries = get_state()["boundaries"]
+            for key in ["legacy", "generators"]:
+                self.assertNotEqual(
+                    boundaries[0]["data"]["PRNG_NumPy"][key],
+                    boundaries[1]["data"]["PRNG_NumPy"][key])
+            self.assertFalse(is_failing())
@@ -1,8 +1,15 @@
 import unittest
+import importlib.util
 import copy
+import os
+import tempfile
+import time
 from rprdcbl import pass_final_boundary, pass_initial_boundary, pass_boundary, is_failing, get_state
-from rprdcbl.processing import _reset_all_for_testing_only
+from rprdcbl import configuration
+from rprdcbl.processing import _reset_all_for_testing_only, _configure_testing, _collect
 from rprdcbl.testers import _deep_equality_test
+from rprdcbl.util import _fingerprint, _diff
+from rprdcbl.printers import _message
 from . import tutils
 
 
@@ -62,3 +69,152 @@ class IndividualTests(unittest.TestCase):
         cds = copy.deepcopy(cds_orig)
         cds["data"]["g"] = [None]
         self.expect_equal_deep_compare(cds, cds_orig, expect=False)
+
+    def testFingerprints(self):
+        value = dict(a=[1, 2, (3, "x")], b=None, c=dict(d=1.5))
+        self.assertEqual(_fingerprint(value),
+                         _fingerprint(copy.deepcopy(value)))
+        self.assertNotEqual(_fingerprint(value),
+                            _fingerprint(dict(a=1)))
+        self.assertNotEqual(_fingerprint(1), _fingerprint(True))
+        self.assertIsNone(_fingerprint(range(1, 5)))
+        # independent of object identity and reference counts
+        shared = "".join(["shared", "value"])
+        self.assertEqual(
+            _fingerprint([shared, shared]),
+            _fingerprint(["sharedvalue", "shared" + "value"]))
+        # buffers are not serialized as plain bytes
+        self.assertNotEqual(_fingerprint([bytearray(b"ab")]),
+                            _fingerprint([b"ab"]))
+        self.assertNotEqual(_fingerprint(memoryview(b"abcd").cast("H")),
+                            _fingerprint(memoryview(b"abcd")))
+
+    def testFingerprintsSkipComparison(self):
+        # equal fingerprints are trusted without comparing the values
+        self.assertEqual(
+            len(
+                _deep_equality_test(1,
+                                    2,
+                                    3,
+                                    _name="custom",
+                                    _fingerprints=("f", "f", "f"))), 0)
+        self.assertEqual(
+            len(
+                _deep_equality_test(1,
+                                    2,
+                                    3,
+                                    _name="custom",
+                                    _fingerprints=("f", "g", None))), 2)
+
+    def testFingerprintsRecorded(self):
+        _reset_all_for_testing_only()
+        pass_initial_boundary()
+        pass_final_boundary(quiet=True)
+        boundaries = get_state()["boundaries"]
+        self.assertEqual(boundaries[0]["fingerprints"]["version"],
+                         boundaries[1]["fingerprints"]["version"])
+        self.assertFalse(is_failing())
+
+    def testParallelCollectionLatency(self):
+        _reset_all_for_testing_only()
+        _configure_testing(collect_mode="thread")
+        configuration._cset("collectors", {
+            k: (lambda: time.sleep(0.2))
+            for k in ["a", "b", "c", "d"]
+        })
+        start = time.perf_counter()
+        _collect()
+        # close to the slowest collector, not the sum (0.8s)
+        self.assertLess(time.perf_counter() - start, 0.6)
+        _reset_all_for_testing_only()
+
+    def testStructuredDiff(self):
+        x = dict(a=1, b=list(range(0, 30)), c=dict(d=None), e="x")
+        y = dict(a=1, b=[-1] * 20, c=dict(d=2), f="y")
+        records = _diff(x,
+                        y,
+                        _x="latest",
+                        _y="previous",
+                        _prefix="custom")
+        self.assertEqual([r["kind"] for r in records], [
+            "extra", "extra", "length", "value", "value", "value",
+            "value", "value", "value", "value", "value", "value",
+            "value", "truncated", "none"
+        ])
+        self.assertEqual(records[3]["path"], "custom.b[0]")
+        self.assertEqual(
+            (records[3]["observed"], records[3]["expected"]), (0, -1))
+        self.assertEqual(
+            [_message(r)
+             for r in records[:3]] + [_message(records[-1])], [
+                 "Elements in 'custom' only contained in the " +
+                 "latest dictionary (but not in the previous): e",
+                 "Elements in 'custom' only contained in the " +
+                 "previous dictionary (but not in the latest): f",
+                 "The lengths of 'custom.b' differ " +
+                 "(latest 30, previous 20).",
+                 "The latest value for 'custom.c.d' is None " +
+                 "but the previous value is not."
+             ])
+        self.assertEqual(len(_diff(x, y, _budget=1)), 1)
+        self.assertEqual(_diff(x, None, _y="reference"), [])
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"),
+                         "requires NumPy")
+    def testArrayDiff(self):
+        import numpy
+        x = numpy.linspace(0.0, 1.0, 1000)
+        y = x.copy()
+        y[[3, 500]] += 1e-3
+        x[7] = y[7] = numpy.nan
+        records = _diff(dict(a=x), dict(a=y), _prefix="custom")
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["kind"], "array")
+        self.assertEqual(
+            (records[0]["observed"], records[0]["expected"]), (2, 1000))
+        self.assertEqual(records[0]["indices"], [[3], [500]])
+        self.assertAlmostEqual(records[0]["max_error"], 1e-3)
+        self.assertTrue(
+            _message(records[0]).startswith(
+                "The values of 'custom.a' differ in 2 of 1000 elements"))
+        self.assertEqual(_diff(x, y, _tolerance=dict(atol=1e-2)), [])
+        self.assertEqual(
+            _diff(1.0, 1.0 + 1e-9, _tolerance=dict(rtol=1e-6)), [])
+        self.assertEqual(_diff(x, y[:10])[0]["kind"], "shape")
+        self.assertEqual(
+            _diff(x, y.astype(numpy.float32))[0]["kind"], "dtype")
+        self.assertIsNotNone(_fingerprint([x, dict(y=y)]))
+        self.assertEqual(_fingerprint(x), _fingerprint(x.copy()))
+        self.assertNotEqual(_fingerprint(x), _fingerprint(y))
+        self.assertIsNone(_fingerprint(numpy.array([object()])))
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"),
+                         "requires NumPy")
+    def testCollectorTolerances(self):
+        import numpy
+        _reset_all_for_testing_only()
+        values = [numpy.ones(100)]
+        with self.assertRaises(Exception):
+            _configure_testing(tolerances=dict(unknown=dict(rtol=1)))
+        with self.assertRaises(Exception):
+            _configure_testing(tolerances=dict(custom=dict(rtol=-1)))
+        lock_file = tempfile.mktemp()
+        self.addCleanup(os.remove, lock_file)
+        # the values change between boundaries and are compared to the
+        # reference only
+        for atol, offset, failing in [(1e-9, 0.0, False),
+                                      (1e-3, 1e-6, False),
+                                      (1e-9, 1e-6, True)]:
+            _reset_all_for_testing_only()
+            values[0] = numpy.ones(100) + offset
+            pass_initial_boundary(
+                lock_file=lock_file,
+                custom_collect=lambda: values[0],
+                tolerances=dict(custom=dict(atol=atol)),
+                fail="never")
+            values[0] = values[0] * 2
+            pass_boundary()
+            pass_final_boundary(quiet=True)
+            self.assertEqual(is_failing(), failing)
+            self.assertTrue(os.path.exists(lock_file))
+        _reset_all_for_testing_only()